@@ -0,0 +1,128 @@
+import heapq
+import time
+import threading
+import numpy as np
+from collections import deque, defaultdict
+from datetime import datetime
+from dateutil import tz
+
+
+class InferenceBudget:
+    """Token bucket that allows at most `per_minute` polls per minute, refilled continuously"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def take(self, wanted):
+        """Takes up to `wanted` tokens and returns how many were granted"""
+        self._refill()
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+    def next_token_in(self):
+        """Seconds until the next whole token is available"""
+        self._refill()
+        return max(0., (1 - self.tokens) * 60 / self.per_minute)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+
+class AdaptiveSchedule:
+    """Gives every camera its own next due time instead of a fixed sweep.
+       The polling interval of a camera shrinks with its recent activity (how busy it is and how much its
+       counts vary) and grows when it stays quiet or during the night hours, within [min, max] interval.
+       All the polls share a global per minute budget; cameras that don't fit in it stay due and are polled
+       first once the budget allows it, which shows up as lag between their scheduled and actual poll times.
+    """
+
+    def __init__(self, cameras, base_interval_sec=300, min_interval_sec=60, max_interval_sec=1800,
+                 budget_per_minute=120, busy_count=10, history=12, night_hours=range(0, 5), night_factor=2.,
+                 timezone='America/Edmonton'):
+        self.cameras = {camera['id']: camera for camera in cameras}
+        self.base_interval_sec = base_interval_sec
+        self.min_interval_sec = min_interval_sec
+        self.max_interval_sec = max_interval_sec
+        self.busy_count = busy_count
+        self.night_hours = night_hours
+        self.night_factor = night_factor
+        self.timezone = tz.gettz(timezone)
+        self.budget = InferenceBudget(budget_per_minute)
+        self.counts = defaultdict(lambda: deque(maxlen=history))
+        self.lags = defaultdict(lambda: deque(maxlen=history))
+        self.quiet_polls = defaultdict(int)
+        self.lock = threading.Lock()
+        now = time.time()
+        # Spreading the first polls over the budget instead of asking for every camera at once
+        spacing = 60 / budget_per_minute
+        self.queue = [(now + index * spacing, camera_id) for index, camera_id in enumerate(self.cameras)]
+        heapq.heapify(self.queue)
+
+    def due(self, now=None):
+        """Pops the cameras that are due, most overdue first, as far as the budget allows.
+           Returns (camera, scheduled time) pairs."""
+        now = now or time.time()
+        with self.lock:
+            waiting = sum(1 for scheduled, _ in self.queue if scheduled <= now)
+            granted = self.budget.take(waiting)
+            due = [heapq.heappop(self.queue) for _ in range(granted)]
+        return [(self.cameras[camera_id], scheduled) for scheduled, camera_id in due]
+
+    def next_due_in(self, now=None):
+        """Seconds until the next camera is due and the budget allows polling it"""
+        now = now or time.time()
+        with self.lock:
+            if not self.queue:
+                return self.base_interval_sec
+            return max(0., self.queue[0][0] - now, self.budget.next_token_in())
+
+    def update_cameras(self, cameras, now=None):
+        """Replaces the polled cameras, e.g. after a refresh of the registry. The new cameras are due now,
+           the removed ones are dropped from the schedule."""
+        now = now or time.time()
+        with self.lock:
+            added = [camera['id'] for camera in cameras if camera['id'] not in self.cameras]
+            self.cameras = {camera['id']: camera for camera in cameras}
+            self.queue = [item for item in self.queue if item[1] in self.cameras]
+            self.queue.extend((now, camera_id) for camera_id in added)
+            heapq.heapify(self.queue)
+
+    def record(self, camera_id, scheduled, polled_at, total_count=None):
+        """Stores the outcome of a poll and schedules the next one. A failed poll (no count) is retried after
+           the base interval without changing the activity history."""
+        with self.lock:
+            # Removed from the registry while it was being polled
+            if camera_id not in self.cameras:
+                return
+            self.lags[camera_id].append(polled_at - scheduled)
+            if total_count is not None:
+                self.counts[camera_id].append(total_count)
+                self.quiet_polls[camera_id] = self.quiet_polls[camera_id] + 1 if total_count == 0 else 0
+                interval = self.interval(camera_id, polled_at)
+            else:
+                interval = self.base_interval_sec
+            heapq.heappush(self.queue, (polled_at + interval, camera_id))
+
+    def interval(self, camera_id, when):
+        counts = np.array(self.counts[camera_id], dtype=np.float64)
+        if len(counts) < 2:
+            interval = self.base_interval_sec
+        else:
+            busy = counts.mean() / (counts.mean() + self.busy_count)
+            variability = counts.std() / (counts.mean() + 1)
+            interval = self.base_interval_sec / (1 + busy + variability)
+            # Backing off exponentially while nothing is detected
+            interval *= 2 ** min(self.quiet_polls[camera_id], 4)
+        if datetime.fromtimestamp(when, tz=self.timezone).hour in self.night_hours:
+            interval *= self.night_factor
+        return float(np.clip(interval, self.min_interval_sec, self.max_interval_sec))
+
+    def lag_report(self):
+        """Latest and worst recent lag in seconds between the scheduled and the actual poll of every camera"""
+        with self.lock:
+            return {camera_id: {'last': lags[-1], 'max': max(lags)} for camera_id, lags in self.lags.items() if lags}
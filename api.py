@@ -1,15 +1,65 @@
+import time
 import simplejson
-from flask import Flask, request, abort
+from flask import Flask, request, abort, g
 from flask_cors import cross_origin
 import werkzeug
-from services import ImageAnalysisService, Database, HistoricalImagePoinst
+from services import ImageAnalysisService, Database, HistoricalImagePoinst, CountSeries
 from config import Config
+from batching import MicroBatcher
+from cache import FrameCache
+from fetcher import ImageFetcher
+from workers import build_detector
+import metrics
 
 app = Flask(__name__)
+# Leaving room for the other headers under the usual 8 KB limit of the proxies and the clients
+MAX_DETECTIONS_HEADER = 6 * 1024
 config = Config()
-image_service = ImageAnalysisService()
-database = Database(config)
-historical_detections = HistoricalImagePoinst(database)
+detector = batcher = frame_cache = image_service = database = historical_detections = count_series = profiler = None
+
+
+def create_app():
+    """Builds the services behind the routes, e.g. `gunicorn 'api:create_app()'`.
+       This is kept out of the module body because the spawned inference workers re-import the main module,
+       and would otherwise each open a database pool and start a batcher, a frame cache and a profiler."""
+    global detector, batcher, frame_cache, image_service, database, historical_detections, count_series, profiler
+    detector = build_detector(config)
+    batcher = MicroBatcher(detector,
+                           max_batch_size=config.inference_batch_size,
+                           max_wait_ms=config.batch_window_ms)
+    frame_cache = FrameCache(max_bytes=config.frame_cache_max_mb * 2 ** 20,
+                             frame_ttl_sec=config.frame_cache_ttl_sec,
+                             detection_ttl_sec=config.detection_cache_ttl_sec,
+                             fetcher=ImageFetcher(pool_size=config.http_pool_size,
+                                                  timeout_sec=config.http_timeout_sec))
+    image_service = ImageAnalysisService(yolo=batcher, frame_cache=frame_cache)
+    database = Database(config)
+    historical_detections = HistoricalImagePoinst(database, frame_cache)
+    count_series = CountSeries(database)
+    profiler = metrics.start_profiler(config)
+    return app
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.set_thread_labels(endpoint=request.endpoint)
+
+
+@app.after_request
+def observe_request_metrics(response):
+    if 'request_start' in g:
+        metrics.REQUEST_SECONDS.labels(endpoint=request.endpoint, status=response.status_code) \
+            .observe(time.perf_counter() - g.request_start)
+    if response.status_code == 200 and request.endpoint not in ('ready', 'prometheus_metrics'):
+        metrics.record_startup('first_request')
+    return response
+
+
+@app.teardown_request
+def reset_request_labels(error=None):
+    # Unlike after_request this also runs when the view raised, so the labels never leak into the next request
+    metrics.set_thread_labels()
 
 
 @app.route('/analysis', methods=['POST', 'GET'])
@@ -34,6 +84,95 @@ def index():
             abort(400, str(e))
 
 
+@app.route('/analysis/image', methods=['POST'])
+@cross_origin()
+def upload_analysis():
+    """Takes the image as a raw image/jpeg body or as the 'image' file of a multipart form instead of base64 JSON.
+       The options are query parameters; output=jpeg returns the annotated image as binary JPEG with the
+       detections in the X-Detections header. Header sizes are usually limited to about 8 KB, so when the
+       detections don't fit in MAX_DETECTIONS_HEADER bytes the header is replaced by X-Detections-Count and
+       the detections have to be asked for as JSON."""
+    try:
+        if request.files:
+            buffer = request.files['image'].read()
+        else:
+            buffer = request.stream.read()
+        params = request.args.to_dict()
+        for flag in ('createImage', 'summerize'):
+            if flag in params:
+                params[flag] = params[flag].lower() == 'true'
+        if 'confidenceThreshold' in params:
+            params['confidenceThreshold'] = float(params['confidenceThreshold'])
+        for option in ('outputWidth', 'jpegQuality'):
+            if option in params:
+                params[option] = int(params[option])
+        binary = params.pop('output', 'json') == 'jpeg'
+
+        prediction = image_service.detect_upload(buffer, params, binary=binary)
+        if binary:
+            response = app.response_class(response=prediction['image'], status=200, mimetype='image/jpeg')
+            detections = simplejson.dumps(prediction['detections'])
+            if len(detections) <= MAX_DETECTIONS_HEADER:
+                response.headers['X-Detections'] = detections
+            else:
+                response.headers['X-Detections-Count'] = str(len(prediction['detections']))
+            return response
+        prediction['detections'] = simplejson.dumps(prediction['detections'])
+        return app.response_class(
+            response=simplejson.dumps(prediction),
+            status=200,
+            mimetype='application/json',
+        )
+    except (werkzeug.exceptions.BadRequest, ValueError) as e:
+        abort(400, str(e))
+
+
+@app.route('/analysis/batch', methods=['POST'])
+@cross_origin()
+def batch_analysis():
+    try:
+        if not request.json or not isinstance(request.json.get('requests'), list):
+            abort(400)
+        predictions = image_service.detect_batch(request.json['requests'])
+        for prediction in predictions:
+            prediction['detections'] = simplejson.dumps(prediction['detections'])
+        response = app.response_class(
+            response=simplejson.dumps(predictions),
+            status=200,
+            mimetype='application/json',
+        )
+        return response
+    except werkzeug.exceptions.BadRequest as e:
+        abort(400, str(e))
+
+
+@app.route('/analysis/metrics', methods=['GET'])
+@cross_origin()
+def analysis_metrics():
+    return app.response_class(
+        response=simplejson.dumps(dict(batcher.metrics(), cache=frame_cache.stats(), detector=detector.status())),
+        status=200,
+        mimetype='application/json',
+    )
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before"""
+    status = detector.status()
+    return app.response_class(
+        response=simplejson.dumps(status),
+        status=200 if status['ready'] else 503,
+        mimetype='application/json',
+    )
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return app.response_class(response=body, status=200, content_type=content_type)
+
+
 @app.route('/historical', methods=['POST', 'GET'])
 @cross_origin()
 def objects_history():
@@ -54,5 +193,21 @@ def objects_history():
             abort(400, str(e))
 
 
+@app.route('/historical/counts', methods=['POST'])
+@cross_origin()
+def historical_counts():
+    """Average counts of many cameras and labels per time bucket, in one columnar response"""
+    try:
+        if not request.json:
+            abort(400)
+        return app.response_class(
+            response=simplejson.dumps(count_series.fetch(request)),
+            status=200,
+            mimetype='application/json',
+        )
+    except werkzeug.exceptions.BadRequest as e:
+        abort(400, str(e))
+
+
 if __name__ == "__main__":
-    app.run()
+    create_app().run()
@@ -0,0 +1,212 @@
+"""Columnar archive of the detections, for the analyses that scan long time ranges without the database.
+
+   Every sweep is appended as a Parquet file to a partition per UTC day (`<root>/date=YYYY-MM-DD/`), with the
+   rows sorted by camera and time. Once a day is over its sweep files are compacted into a single file whose row
+   groups cover a few cameras each, so the reads by camera skip most of the file from its statistics alone.
+   The reads memory-map the files and return NumPy arrays.
+
+   python archive.py compact
+"""
+import os
+import glob
+import uuid
+import argparse
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+from config import Config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SCHEMA = pa.schema([
+    ('camera_id', pa.int32()),
+    ('time', pa.timestamp('us', tz='UTC')),
+    ('label', pa.string()),
+    ('x_top_left', pa.int32()),
+    ('y_top_left', pa.int32()),
+    ('x_bottom_right', pa.int32()),
+    ('y_bottom_right', pa.int32()),
+    ('x_center', pa.float32()),
+    ('y_center', pa.float32()),
+    ('confidence', pa.float32()),
+])
+BOX_COLUMNS = ('x_top_left', 'y_top_left', 'x_bottom_right', 'y_bottom_right')
+COMPACTED = 'compacted.parquet'
+
+
+class DetectionArchive:
+    """Appends the sweep detections to the Parquet archive under `root` and reads them back by camera"""
+
+    def __init__(self, root, row_group_size=65536):
+        self.root = root
+        self.row_group_size = row_group_size
+        self.current_day = None
+
+    def append(self, detections):
+        """Writes the detections of a sweep (the Scheduler.summarize dicts).Returns the number of rows written"""
+        frames = [detection for detection in detections if len(detection['detection'])]
+        if not frames:
+            return 0
+        sizes = [len(detection['detection']) for detection in frames]
+        times = np.repeat(np.array([_utc(detection['time']) for detection in frames], dtype='datetime64[us]'),
+                          sizes)
+        camera_ids = np.repeat([detection['camera']['id'] for detection in frames], sizes).astype(np.int32)
+        boxes = np.concatenate([detection['detection'].boxes for detection in frames])
+        centers = np.concatenate([detection['detection'].centers() for detection in frames]).astype(np.float32)
+        columns = {
+            'camera_id': camera_ids,
+            'time': times,
+            'label': np.array([label for detection in frames for label in detection['detection'].label_names()],
+                              dtype=object),
+            'x_center': centers[:, 0],
+            'y_center': centers[:, 1],
+            'confidence': np.concatenate([detection['detection'].scores for detection in frames]),
+        }
+        columns.update((name, boxes[:, index]) for index, name in enumerate(BOX_COLUMNS))
+
+        order = np.lexsort((times, camera_ids))
+        days = times[order].astype('datetime64[D]')
+        for day in np.unique(days):
+            rows = order[days == day]
+            table = pa.Table.from_arrays([pa.array(columns[field.name][rows], type=field.type) for field in SCHEMA],
+                                         schema=SCHEMA)
+            self._write(table, self._partition(day), f'sweep-{uuid.uuid4().hex}.parquet')
+        self._roll_over(days.max())
+        return len(order)
+
+    def read(self, camera_id, label=None, since=None, until=None):
+        """The detections of a camera, optionally of one label and in [since, until), as NumPy arrays:
+           time (datetime64[us], UTC), label, boxes (N x 4), centers (N x 2) and confidence.
+           The columns are memory-mapped from the files, only the selected rows are copied."""
+        since = np.datetime64(_utc(since), 'us') if since else None
+        until = np.datetime64(_utc(until), 'us') if until else None
+        parts = {name: [] for name in SCHEMA.names}
+        for path in self._files(since, until):
+            parquet = pq.ParquetFile(path, memory_map=True)
+            groups = [index for index in range(parquet.num_row_groups) if _may_contain(parquet, index, camera_id)]
+            if not groups:
+                continue
+            table = parquet.read_row_groups(groups)
+            times = table.column('time').to_numpy()
+            mask = table.column('camera_id').to_numpy() == camera_id
+            if since is not None:
+                mask &= times >= since
+            if until is not None:
+                mask &= times < until
+            if label is not None:
+                mask &= table.column('label').to_numpy() == label
+            for name in SCHEMA.names:
+                parts[name].append(table.column(name).to_numpy()[mask])
+
+        columns = {name: np.concatenate(values) if values else np.zeros(0, dtype=_numpy_type(SCHEMA.field(name)))
+                   for name, values in parts.items()}
+        return {
+            'time': columns['time'].astype('datetime64[us]'),
+            'label': columns['label'].astype(str),
+            'boxes': np.column_stack([columns[name] for name in BOX_COLUMNS]).astype(np.int32).reshape(-1, 4),
+            'centers': np.column_stack([columns['x_center'], columns['y_center']]).astype(np.float32).reshape(-1, 2),
+            'confidence': columns['confidence'].astype(np.float32),
+        }
+
+    def compact(self, day):
+        """Merges the sweep files of a finished day into one file sorted by camera and time"""
+        directory = self._partition(day)
+        sweeps = sorted(glob.glob(os.path.join(directory, 'sweep-*.parquet')))
+        if not sweeps:
+            return
+        tables = [pq.read_table(path, memory_map=True) for path in sweeps]
+        if os.path.exists(os.path.join(directory, COMPACTED)):
+            # A sweep written after a previous compaction (e.g. a late restart) is merged into it
+            tables.append(pq.read_table(os.path.join(directory, COMPACTED), memory_map=True))
+        table = pa.concat_tables(tables)
+        order = np.lexsort((table.column('time').to_numpy(), table.column('camera_id').to_numpy()))
+        self._write(table.take(pa.array(order)), directory, COMPACTED)
+        for path in sweeps:
+            os.remove(path)
+        logger.info(f'Compacted {len(sweeps)} sweep files of {day}')
+
+    def compact_finished(self):
+        """Compacts every day before the current UTC day that still has sweep files"""
+        today = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), 'D')
+        for directory in sorted(glob.glob(os.path.join(self.root, 'date=*'))):
+            day = np.datetime64(os.path.basename(directory)[len('date='):], 'D')
+            if day < today:
+                self.compact(day)
+
+    def _roll_over(self, day):
+        if self.current_day is None:
+            self.compact_finished()
+        elif day > self.current_day:
+            self.compact(self.current_day)
+        self.current_day = day if self.current_day is None else max(day, self.current_day)
+
+    def _files(self, since, until):
+        """The files of the day partitions overlapping [since, until). A compacted day is read from its
+           compacted file, plus the sweeps written to it after the compaction; the sweeps it already holds
+           may not be deleted yet."""
+        first = since.astype('datetime64[D]') if since is not None else None
+        last = until.astype('datetime64[D]') if until is not None else None
+        for directory in sorted(glob.glob(os.path.join(self.root, 'date=*'))):
+            day = np.datetime64(os.path.basename(directory)[len('date='):], 'D')
+            if (first is not None and day < first) or (last is not None and day > last):
+                continue
+            sweeps = sorted(glob.glob(os.path.join(directory, 'sweep-*.parquet')))
+            compacted = os.path.join(directory, COMPACTED)
+            if os.path.exists(compacted):
+                compacted_at = os.path.getmtime(compacted)
+                sweeps = [compacted] + [path for path in sweeps if os.path.getmtime(path) > compacted_at]
+            yield from sweeps
+
+    def _partition(self, day):
+        return os.path.join(self.root, f'date={day}')
+
+    def _write(self, table, directory, name):
+        """Writes next to the target and renames, so the readers never see a partial file"""
+        os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, f'.{name}.tmp')
+        pq.write_table(table, temporary, row_group_size=self.row_group_size)
+        os.replace(temporary, os.path.join(directory, name))
+
+
+def _utc(value):
+    """Naive UTC datetime of an ISO string or a datetime, as NumPy wants them"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _may_contain(parquet, index, camera_id):
+    """Whether the statistics of a row group allow it to hold rows of the camera"""
+    column = parquet.schema_arrow.get_field_index('camera_id')
+    statistics = parquet.metadata.row_group(index).column(column).statistics
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return statistics.min <= camera_id <= statistics.max
+
+
+def _numpy_type(field):
+    if pa.types.is_timestamp(field.type):
+        return 'datetime64[us]'
+    if pa.types.is_string(field.type):
+        return str
+    return field.type.to_pandas_dtype()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)-15s %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['compact'])
+    parser.add_argument('--root', default=Config().archive_path, help='Archive directory (ARCHIVE_PATH)')
+    args = parser.parse_args()
+    if not args.root:
+        parser.error('Set ARCHIVE_PATH or pass --root')
+    DetectionArchive(args.root).compact_finished()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import time
+import asyncio
+import logging
+import aiohttp
+import asyncpg
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from fetcher import decode_image, conditional_headers, response_validator
+from ingestion import detection_rows, COUNT_COLUMNS, LOCATION_COLUMNS
+from rollups import update_rollups_async
+from metrics import timed, record_startup
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncScheduler:
+    """asyncio flavour of the sweep loop. The camera images are downloaded with aiohttp, at most FETCH_WORKERS
+       at a time and each under its own timeout, so a slow camera only delays itself. The decoding and the
+       inference run on a thread pool, and every inference batch is written to the database with asyncpg as
+       soon as it is done instead of at the end of the sweep.
+       It reuses the cameras, the frame cache (conditional GETs and cached detections), the frame gating and
+       the detection summaries of the synchronous `scheduler`.
+    """
+
+    def __init__(self, scheduler, config, target_labels):
+        self.scheduler = scheduler
+        self.config = config
+        self.target_labels = target_labels
+        self.executor = ThreadPoolExecutor(max_workers=config.inference_workers)
+        self.frames = scheduler.frame_cache.frames
+        self.timeout = aiohttp.ClientTimeout(total=config.http_timeout_sec)
+
+    async def run(self):
+        self.pool = await asyncpg.create_pool(host=self.config.postgres_host,
+                                              database=self.config.postgres_database_name,
+                                              user=self.config.postgres_username,
+                                              password=self.config.postgres_password,
+                                              min_size=self.config.postgres_pool_min_size,
+                                              max_size=self.config.postgres_pool_max_size)
+        connector = aiohttp.TCPConnector(limit=self.config.fetch_workers)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            while True:
+                try:
+                    start_time = time.monotonic()
+                    await asyncio.get_running_loop().run_in_executor(self.executor, self.scheduler.refresh_cameras)
+                    inserted = await self.sweep(session)
+                    elapsed_time = time.monotonic() - start_time
+                    record_startup('first_sweep')
+                    waiting_time = max(0, self.scheduler.FETCHING_INTERVAL_SEC - elapsed_time)
+                    logger.info(f'Elapsed time: {elapsed_time}, {inserted} cameras inserted')
+                    logger.info(f'Waiting for : {waiting_time} sec.')
+                    await asyncio.sleep(waiting_time)
+                except Exception as err:
+                    logger.error(f'Exception happened :{err} , Time : {datetime.now().isoformat()}', exc_info=True)
+
+    async def sweep(self, session):
+        """Streams every camera through download -> inference -> database write and returns the number
+           of cameras written"""
+        frames = asyncio.Queue(maxsize=self.config.prefetch_queue_size)
+        consumers = [asyncio.create_task(self._consume(frames)) for _ in range(self.config.inference_workers)]
+        # aiohttp counts the wait for a free connection in the request timeout, so the requests are queued
+        # here and the timeout only starts once the camera is actually requested
+        slots = asyncio.Semaphore(self.config.fetch_workers)
+        await asyncio.gather(*(self._download(session, camera, frames, slots) for camera in self.scheduler.cameras))
+        for _ in consumers:
+            await frames.put(None)
+        return sum(await asyncio.gather(*consumers))
+
+    async def _download(self, session, camera, frames, slots):
+        """Queues the camera with its new JPEG, or with its cached frame when it has not expired yet or the
+           camera answers the conditional GET with a 304"""
+        url = camera['image_url']
+        cached = self.frames.get(url)
+        if cached is not None:
+            await frames.put((camera, None, cached))
+            return
+        stale = self.frames.peek(url, include_expired=True)
+        try:
+            async with slots:
+                with timed('fetch', camera=camera['id']):
+                    async with session.get(url, headers=conditional_headers(stale and stale[0]),
+                                           timeout=self.timeout) as response:
+                        if response.status == 304 and stale:
+                            content, entry = None, stale
+                        else:
+                            response.raise_for_status()
+                            content = await response.read()
+                            entry = (response_validator(response.headers, content), None)
+        except Exception as err:
+            logger.error(f"Failed to fetch camera {camera['id']}: {err!r}")
+            return
+        await frames.put((camera, content, entry))
+
+    async def _consume(self, frames):
+        written = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await frames.get()]
+            while batch[-1] is not None and len(batch) < self.config.inference_batch_size and not frames.empty():
+                batch.append(frames.get_nowait())
+            done = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                try:
+                    detections = await loop.run_in_executor(self.executor, self._detect, batch)
+                    if detections:
+                        await self.write(detections)
+                    written += len(detections)
+                except Exception as err:
+                    logger.error(f'Failed to process a batch of {len(batch)} cameras: {err}', exc_info=True)
+            if done:
+                return written
+
+    def _detect(self, batch):
+        """Decodes the new frames into the frame cache, so the next sweep can revalidate them, and runs the
+           detection on the batch. A frame that can't be decoded only drops its own camera."""
+        cameras, images = [], []
+        for camera, content, (validator, image) in batch:
+            if content is not None:
+                try:
+                    image = decode_image(content)
+                except Exception as err:
+                    logger.error(f"Failed to decode the image of camera {camera['id']}: {err!r}")
+                    continue
+            self.frames.put(camera['image_url'], (validator, image), image.nbytes)
+            cameras.append(camera)
+            images.append(image)
+        return self.scheduler.detect_images(cameras, images) if cameras else []
+
+    async def write(self, detections):
+        count_rows, location_rows = detection_rows(detections, self.target_labels)
+        # asyncpg's binary COPY needs real timestamps instead of the ISO strings
+        count_rows = [(row[0], datetime.fromisoformat(row[1])) + row[2:] for row in count_rows]
+        location_rows = [(row[0], datetime.fromisoformat(row[1])) + row[2:] for row in location_rows]
+        with timed('db_write'):
+            async with self.pool.acquire() as connection, connection.transaction():
+                if count_rows:
+                    await connection.copy_records_to_table('count', records=count_rows, columns=COUNT_COLUMNS)
+                    await update_rollups_async(connection, count_rows)
+                if location_rows:
+                    await connection.copy_records_to_table('object_location', records=location_rows,
+                                                           columns=LOCATION_COLUMNS)
+        if self.scheduler.archive:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.scheduler.archive_detections,
+                                                             detections)
@@ -0,0 +1,88 @@
+import time
+import queue
+import threading
+import logging
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects the images submitted by concurrent requests into a queue and runs them through the detector
+       as one batch. A batch is closed when it reaches `max_batch_size` images or when its first image has
+       waited for `max_wait_ms`. Each caller blocks only on its own result.
+       It exposes the same detect/detect_batch interface as YOLO, so it can be used as a drop in detector.
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10, latency_window=1000):
+        self.detector = detector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_sec = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_count = 0
+        self.batched_images = 0
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def detect(self, image):
+        return self.submit(image).result()
+
+    def detect_batch(self, images):
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def submit(self, image):
+        """Queues the image for the next batch and returns a Future of its detections"""
+        future = Future()
+        self.requests.put((image, future, time.monotonic()))
+        return future
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_count = self.batch_count
+            batched_images = self.batched_images
+        return {
+            'queueDepth': self.requests.qsize(),
+            'batches': batch_count,
+            'images': batched_images,
+            'batchFillRatio': batched_images / (batch_count * self.max_batch_size) if batch_count else 0.,
+            'latencyP50Ms': float(np.percentile(latencies, 50)) if latencies.size else 0.,
+            'latencyP99Ms': float(np.percentile(latencies, 99)) if latencies.size else 0.,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait_sec
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        images, futures, submitted_times = zip(*batch)
+        try:
+            results = self.detector.detect_batch(list(images))
+        except Exception as err:
+            logger.error(f'Batched detection of {len(batch)} images failed: {err}')
+            for future in futures:
+                future.set_exception(err)
+            return
+
+        finished = time.monotonic()
+        for future, result in zip(futures, results):
+            future.set_result(result)
+        with self.lock:
+            self.batch_count += 1
+            self.batched_images += len(batch)
+            self.latencies.extend(finished - submitted for submitted in submitted_times)
@@ -0,0 +1,81 @@
+"""Checks that the OpenCV DNN backend detects the same objects as the darkflow backend on a directory of
+   camera frames and compares their per-frame latency. Exits with a non-zero status when the share of
+   matched detections is below --min-match.
+
+   python -m benchmarks.backend_parity frames/ --min-match 0.95
+"""
+import sys
+import glob
+import argparse
+import cv2
+import numpy as np
+from yolo import YOLO
+from benchmarks.common import measure, summarize, report
+
+
+def iou(first, second):
+    x0, y0 = max(first[0], second[0]), max(first[1], second[1])
+    x1, y1 = min(first[2], second[2]), min(first[3], second[3])
+    intersection = max(0, x1 - x0 + 1) * max(0, y1 - y0 + 1)
+    area = lambda box: (box[2] - box[0] + 1) * (box[3] - box[1] + 1)
+    return intersection / (area(first) + area(second) - intersection)
+
+
+def as_box(detection):
+    return (detection['topleft']['x'], detection['topleft']['y'],
+            detection['bottomright']['x'], detection['bottomright']['y'])
+
+
+def matches(expected, actual, min_iou):
+    """Number of the expected detections that have an unused actual detection with the same label"""
+    used = set()
+    matched = 0
+    for detection in expected:
+        candidates = [(iou(as_box(detection), as_box(other)), index) for index, other in enumerate(actual)
+                      if index not in used and other['label'] == detection['label']]
+        best = max(candidates, default=(0, None))
+        if best[0] >= min_iou:
+            used.add(best[1])
+            matched += 1
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', help='Directory of JPEG camera frames')
+    parser.add_argument('--min-iou', type=float, default=0.9)
+    parser.add_argument('--min-match', type=float, default=0.95)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = [cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+              for path in sorted(glob.glob(f'{args.frames}/*.jpg'))]
+    reference = YOLO(backend='darkflow')
+    candidate = YOLO(backend='opencv')
+
+    expected_total = actual_total = matched_total = 0
+    for image in images:
+        expected, actual = reference.detect(image).to_dicts(), candidate.detect(image).to_dicts()
+        expected_total += len(expected)
+        actual_total += len(actual)
+        matched_total += matches(expected, actual, args.min_iou)
+    match_ratio = matched_total / expected_total if expected_total else 1.
+
+    results = {
+        'frames': len(images),
+        'darkflowDetections': expected_total,
+        'opencvDetections': actual_total,
+        'matched': matched_total,
+        'matchRatio': match_ratio,
+        'darkflow': summarize(measure(lambda: [reference.detect(image) for image in images], args.repeat),
+                              items=len(images)),
+        'opencv': summarize(measure(lambda: [candidate.detect(image) for image in images], args.repeat),
+                            items=len(images)),
+    }
+    report('backend_parity', results)
+    if match_ratio < args.min_match or actual_total > np.ceil(expected_total / args.min_match):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import json
+import time
+import tracemalloc
+import numpy as np
+
+
+def measure(function, repeat=5):
+    """Runs the function `repeat` times and returns the elapsed seconds of every run"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations, items=1):
+    """Latency percentiles in milliseconds and the throughput in items per second"""
+    durations = np.array(durations)
+    return {
+        'runs': len(durations),
+        'p50Ms': float(np.percentile(durations, 50) * 1000),
+        'p95Ms': float(np.percentile(durations, 95) * 1000),
+        'p99Ms': float(np.percentile(durations, 99) * 1000),
+        'throughput': float(items / np.median(durations)) if np.median(durations) > 0 else 0.,
+    }
+
+
+def peak_memory(function):
+    """Peak bytes allocated by Python and NumPy while the function runs"""
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def report(name, results, output=None):
+    """Prints the results as JSON, and also writes them to the `output` file when given"""
+    document = json.dumps({'benchmark': name, 'results': results}, indent=2)
+    print(document)
+    if output:
+        with open(output, 'w') as file:
+            file.write(document)
@@ -0,0 +1,205 @@
+"""Replays a directory of saved camera frames through the hot paths of the service and reports the latency
+   percentiles, the throughput and the peak memory of every stage as JSON:
+
+     detect             YOLO.detect with a stub network (decoding, thresholding and NMS only)
+     parse_image        ImageAnalysisService._parse_image of a base64 request
+     draw_objects       ImageAnalysisService._draw_objects
+     insert_detections  the rows of a sweep written as Scheduler.insert_detections does
+     historical_draw    HistoricalImagePoinst.draw of the stored object locations
+
+   The database is an in-memory SQLite stand-in unless --postgres is given. Without a frame directory,
+   random frames are generated.
+
+   python -m benchmarks frames/ --output baseline.json
+"""
+import glob
+import base64
+import sqlite3
+import argparse
+import resource
+import cv2
+import numpy as np
+import psycopg2
+from datetime import datetime
+from config import Config
+from yolo import YOLO
+from cache import FrameCache
+from services import ImageAnalysisService, HistoricalImagePoinst
+from ingestion import detection_rows, copy_rows, COUNT_COLUMNS, LOCATION_COLUMNS
+from benchmarks.common import measure, summarize, peak_memory, report
+
+TARGET_LABELS = ['car', 'person', 'truck', 'bus', 'bicycle', 'motorbike']
+
+SCHEMA = """
+CREATE TEMP TABLE count (camera_id int, time timestamp, label text, count int, confidence float);
+CREATE TEMP TABLE object_location (camera_id int, label text, x_top_left int, y_top_left int, x_bottom_right int,
+                                   y_bottom_right int, confidence float, x_center float, y_center float,
+                                   time timestamp);
+"""
+
+
+class StubBackend:
+    """Stands in for the network: returns `objects` confident random boxes per frame among the cells of a
+       13x13 grid with 5 anchors, so everything after the forward pass runs on realistic shapes"""
+
+    def __init__(self, labels, objects=20, cells=13 * 13 * 5, seed=0):
+        self.labels = labels
+        self.objects = objects
+        self.cells = cells
+        self.random = np.random.RandomState(seed)
+
+    def forward(self, images):
+        corners = self.random.uniform(0, 0.9, (len(images), self.cells, 2))
+        sizes = self.random.uniform(0.02, 0.1, (len(images), self.cells, 2))
+        boxes = np.concatenate([corners, corners + sizes], axis=-1)
+        class_probs = self.random.uniform(0, 0.05, (len(images), self.cells, len(self.labels)))
+        for frame in class_probs:
+            confident = self.random.choice(self.cells, self.objects, replace=False)
+            frame[confident, self.random.randint(0, len(self.labels), self.objects)] = \
+                self.random.uniform(0.3, 1, self.objects)
+        return boxes, class_probs
+
+
+class StubYOLO(YOLO):
+    """YOLO running on the StubBackend, without loading any weights"""
+
+    def __init__(self, objects=20):
+        with open(self.options['labels']) as labels:
+            self.backend = StubBackend([label.strip() for label in labels if label.strip()], objects)
+
+
+class SQLiteDatabase:
+    """In-memory stand-in for the Postgres tables, with the `bulk_insert` of fetch_scheduler.Postgres and the
+       `fetch_prepared` of services.Database.The `on_copy` hook (the Postgres rollups) is not run."""
+    # Same columns as the object_locations query of services.Database
+    QUERIES = {
+        'object_locations': "select camera_id, label, confidence, cast(x_center as int), cast(y_center as int), time "
+                            "from object_location where camera_id=? and label=? and confidence > ?",
+    }
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript(SCHEMA.replace('TEMP ', ''))
+
+    def bulk_insert(self, table, columns, rows, retries=1, on_copy=None):
+        self.conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                              rows)
+        self.conn.commit()
+
+    def fetch_prepared(self, name, params):
+        cursor = self.conn.execute(self.QUERIES[name], params)
+        return cursor.fetchall(), [description[0] for description in cursor.description]
+
+
+class PostgresDatabase:
+    """Writes to temporary tables of the configured Postgres database and reads them back through the same
+       connection, with the queries of the SQLite stand-in. The temporary tables shadow the real ones, which
+       are neither read nor migrated."""
+    QUERIES = {name: query.replace('?', '%s') for name, query in SQLiteDatabase.QUERIES.items()}
+
+    def __init__(self, config):
+        self.conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                                     user=config.postgres_username, password=config.postgres_password)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(SCHEMA)
+
+    def bulk_insert(self, table, columns, rows, retries=1, on_copy=None):
+        copy_rows(self.cursor, table, columns, rows)
+        self.conn.commit()
+
+    def fetch_prepared(self, name, params):
+        self.cursor.execute(self.QUERIES[name], params)
+        return self.cursor.fetchall(), [description[0] for description in self.cursor.description]
+
+
+class ReplayFrameCache:
+    """Serves the saved frames in place of the camera downloads of the frame cache"""
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def fetch(self, url):
+        camera_id = int(url.split('/')[-1].split('.')[0][3:])
+        return self.frames[camera_id % len(self.frames)].copy()
+
+
+class JSONRequest:
+    """The part of a flask request HistoricalImagePoinst reads"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get_json(self, force=False):
+        return self.payload
+
+
+def load_frames(directory, synthetic, width, height):
+    if directory:
+        encoded = []
+        for path in sorted(glob.glob(f'{directory}/*.jpg')):
+            with open(path, 'rb') as frame:
+                encoded.append(frame.read())
+    else:
+        encoded = [cv2.imencode('.jpg', np.random.randint(0, 255, (height, width, 3), dtype=np.uint8))[1].tobytes()
+                   for _ in range(synthetic)]
+    if not encoded:
+        raise SystemExit(f'No .jpg frames found in {directory}')
+    return encoded
+
+
+def stage(function, items, repeat):
+    """Per item latencies of `function(item)` over `repeat` passes, and the peak memory of one pass"""
+    durations = []
+    for _ in range(repeat):
+        durations.extend(duration for item in items for duration in measure(lambda: function(item), 1))
+    return dict(summarize(durations), items=len(items),
+                peakMemoryBytes=peak_memory(lambda: [function(item) for item in items]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', nargs='?', help='Directory of JPEG camera frames')
+    parser.add_argument('--synthetic', type=int, default=50, help='Random frames to use without a directory')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--objects', type=int, default=20, help='Detections returned by the stub per frame')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--postgres', action='store_true', help='Use the configured Postgres instead of SQLite')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    encoded = load_frames(args.frames, args.synthetic, args.width, args.height)
+    images = [cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR) for buffer in encoded]
+    yolo = StubYOLO(args.objects)
+    service = ImageAnalysisService(yolo=yolo, frame_cache=FrameCache())
+    database = PostgresDatabase(Config()) if args.postgres else SQLiteDatabase()
+    historical = HistoricalImagePoinst(database, ReplayFrameCache(images))
+
+    requests = [service._parse_params({'image': base64.b64encode(buffer).decode(), 'createImage': True})
+                for buffer in encoded]
+    detections = [yolo.detect(image) for image in images]
+    sweep = [{'camera': {'id': camera_id}, 'detection': frame, 'counts': frame.counts(),
+              'countsConfidence': frame.mean_confidence(), 'time': datetime.now().isoformat()}
+             for camera_id, frame in enumerate(detections)]
+
+    def insert_detections(sweep):
+        count_rows, location_rows = detection_rows(sweep, TARGET_LABELS)
+        database.bulk_insert('count', COUNT_COLUMNS, count_rows)
+        database.bulk_insert('object_location', LOCATION_COLUMNS, location_rows)
+
+    results = {
+        'detect': stage(yolo.detect, images, args.repeat),
+        'parse_image': stage(service._parse_image, requests, args.repeat),
+        'draw_objects': stage(lambda index: service._draw_objects(images[index], detections[index], requests[index]),
+                              range(len(images)), args.repeat),
+        'insert_detections': stage(insert_detections, [sweep], args.repeat),
+        'historical_draw': stage(historical.draw, [JSONRequest({'cameraId': camera_id}) for camera_id in
+                                                   range(len(images))], args.repeat),
+    }
+    results['insert_detections']['rows'] = sum(len(rows) for rows in detection_rows(sweep, TARGET_LABELS))
+    results['maxResidentBytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    report('harness', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
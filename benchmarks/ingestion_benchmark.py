@@ -0,0 +1,76 @@
+"""Compares the detection ingestion paths against a local Postgres:
+   the legacy one INSERT statement per row, execute_values with parameter binding and COPY FROM STDIN.
+
+   python -m benchmarks.ingestion_benchmark --cameras 300 --objects 20 --repeat 5
+"""
+import argparse
+import psycopg2
+import numpy as np
+from datetime import datetime
+from psycopg2.extras import execute_values
+from config import Config
+from detections import Detections
+from ingestion import detection_rows, copy_rows, COUNT_COLUMNS, LOCATION_COLUMNS
+from benchmarks.common import measure, summarize, report
+
+LABELS = ['car', 'person', 'truck', 'bus', 'bicycle']
+
+SCHEMA = """
+CREATE TEMP TABLE count (camera_id int, time timestamptz, label text, count int, confidence float);
+CREATE TEMP TABLE object_location (camera_id int, time timestamptz, label text, x_top_left int, y_top_left int,
+                                   x_bottom_right int, y_bottom_right int, x_center float, y_center float,
+                                   confidence float);
+"""
+
+
+def synthetic_detections(cameras, objects):
+    detections = []
+    for camera_id in range(cameras):
+        corners = np.column_stack([np.random.randint(0, 300, objects), np.random.randint(0, 200, objects)])
+        frame = Detections(np.hstack([corners, corners + [40, 30]]), np.random.rand(objects),
+                           np.random.randint(0, len(LABELS), objects), LABELS)
+        detections.append({'camera': {'id': camera_id}, 'detection': frame, 'counts': frame.counts(),
+                           'countsConfidence': frame.mean_confidence(), 'time': datetime.now().isoformat()})
+    return detections
+
+
+def legacy_insert(cursor, table, columns, rows):
+    for row in rows:
+        values = ','.join(f"'{value}'" if isinstance(value, str) else str(value) for value in row)
+        cursor.execute(f"INSERT INTO {table} ({','.join(columns)}) VALUES ({values})")
+
+
+def values_insert(cursor, table, columns, rows):
+    execute_values(cursor, f"INSERT INTO {table} ({','.join(columns)}) VALUES %s", rows, page_size=1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cameras', type=int, default=300)
+    parser.add_argument('--objects', type=int, default=20, help='Detected objects per camera')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    config = Config()
+    conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                            user=config.postgres_username, password=config.postgres_password)
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA)
+    count_rows, location_rows = detection_rows(synthetic_detections(args.cameras, args.objects), LABELS)
+    total_rows = len(count_rows) + len(location_rows)
+
+    results = {}
+    for name, insert in [('legacy_insert', legacy_insert), ('execute_values', values_insert), ('copy', copy_rows)]:
+        def sweep():
+            insert(cursor, 'count', COUNT_COLUMNS, count_rows)
+            insert(cursor, 'object_location', LOCATION_COLUMNS, location_rows)
+            conn.commit()
+
+        results[name] = summarize(measure(sweep, args.repeat), items=total_rows)
+        results[name]['rows'] = total_rows
+    conn.close()
+    report('ingestion', results)
+
+
+if __name__ == '__main__':
+    main()
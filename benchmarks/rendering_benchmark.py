@@ -0,0 +1,57 @@
+"""Measures the cost of a createImage=true response (drawing plus JPEG encoding) as a function of the number
+   of detections, for the legacy per box drawing (a full frame cvtColor per box, resize at the end) and for
+   the resize-first single buffer rendering.
+
+   python -m benchmarks.rendering_benchmark --width 1280 --height 720 --counts 0 10 50 200
+"""
+import base64
+import argparse
+import cv2
+import numpy as np
+from detections import Detections
+from rendering import render_detections, encode_jpeg
+from services import image_resize
+from benchmarks.common import measure, summarize, report
+
+
+def legacy_render(image, detections):
+    """The drawing of ImageAnalysisService._draw_objects before the rendering stage"""
+    image = image.copy()
+    for x0, y0, x1, y1 in detections.boxes.tolist():
+        image = cv2.rectangle(image, (x0, y0), (x1, y1), (0, 255, 0), 2)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image = image_resize(image, height=200, width=400)
+    _, values = cv2.imencode('.jpg', image)
+    return base64.b64encode(values)
+
+
+def render(image, detections):
+    return base64.b64encode(encode_jpeg(render_detections(image, detections, width=400)))
+
+
+def synthetic_detections(count, width, height):
+    corners = np.column_stack([np.random.randint(0, width - 60, count), np.random.randint(0, height - 40, count)])
+    return Detections(np.hstack([corners, corners + [60, 40]]), np.random.rand(count), np.zeros(count), ['car'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--counts', type=int, nargs='+', default=[0, 10, 50, 200])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    image = np.random.randint(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    results = {}
+    for count in args.counts:
+        detections = synthetic_detections(count, args.width, args.height)
+        results[count] = {
+            'legacy': summarize(measure(lambda: legacy_render(image, detections), args.repeat)),
+            'render': summarize(measure(lambda: render(image, detections), args.repeat)),
+        }
+    report('rendering', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Compares the legacy fetch_counts query with the rollups on a synthetic count table.
+   The table is generated inside its own schema, which is dropped at the end unless --keep is given.
+
+   python -m benchmarks.rollups_benchmark --rows 100000000 --cameras 300
+"""
+import argparse
+import time
+import psycopg2
+import rollups
+from config import Config
+from benchmarks.common import measure, summarize, report
+
+SCHEMA = 'rollups_benchmark'
+
+LEGACY_QUERY = "select date_trunc(%(bucket)s,time) as ttime,camera_id,label, avg(count) from count " \
+               "group by date_trunc(%(bucket)s,time) ,camera_id,label " \
+               "having camera_id=%(camera)s and label =%(label)s order by ttime desc limit %(limit)s"
+
+RAW_QUERY = "select date_trunc(%(bucket)s, time) as ttime, camera_id, label, avg(count) from count " \
+            "where camera_id=%(camera)s and label=%(label)s group by 1, camera_id, label order by ttime desc limit %(limit)s"
+
+GENERATE = """
+CREATE TABLE count (camera_id int, time timestamptz, label text, count int, confidence float);
+INSERT INTO count
+SELECT i %% %(cameras)s,
+       now() - interval '5 minutes' * (i / %(cameras)s),
+       (ARRAY['car', 'person', 'truck', 'bus', 'bicycle'])[1 + (i / %(cameras)s) %% 5],
+       (random() * 20)::int,
+       random()
+FROM generate_series(0, %(rows)s - 1) AS i;
+CREATE INDEX ON count (camera_id, label, time);
+ANALYZE count;
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--cameras', type=int, default=300)
+    parser.add_argument('--camera', type=int, default=75, help='Camera id used by the queries')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='Keep the generated schema')
+    args = parser.parse_args()
+
+    config = Config()
+    conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                            user=config.postgres_username, password=config.postgres_password)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path TO {SCHEMA}")
+    start = time.perf_counter()
+    cursor.execute(GENERATE, {'rows': args.rows, 'cameras': args.cameras})
+    conn.commit()
+    results = {'generateSec': time.perf_counter() - start, 'rows': args.rows}
+
+    rollups.migrate(cursor)
+    conn.commit()
+    start = time.perf_counter()
+    rollups.backfill(conn)
+    results['backfillSec'] = time.perf_counter() - start
+
+    cursor.execute(f"PREPARE fetch_rollup_counts AS {rollups.FETCH_COUNTS}")
+    for bucket in rollups.ROLLUP_BUCKETS:
+        params = {'bucket': bucket, 'camera': args.camera, 'label': 'car', 'limit': 24}
+        results[bucket] = {
+            'legacy': summarize(measure(lambda: cursor.execute(LEGACY_QUERY, params) or cursor.fetchall(),
+                                        args.repeat)),
+            'raw': summarize(measure(lambda: cursor.execute(RAW_QUERY, params) or cursor.fetchall(), args.repeat)),
+            'rollup': summarize(measure(lambda: cursor.execute("EXECUTE fetch_rollup_counts (%s, %s, %s, %s)",
+                                                               (bucket, args.camera, 'car', 24)) or cursor.fetchall(),
+                                        args.repeat)),
+        }
+
+    if not args.keep:
+        cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+    report('rollups', results)
+
+
+if __name__ == '__main__':
+    main()
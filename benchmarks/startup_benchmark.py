@@ -0,0 +1,61 @@
+"""Measures the cold start of the API: the time from launching `python api.py` until it answers a first
+   request, until /ready reports the model as warmed up, and until a first detection is served.
+
+   python -m benchmarks.startup_benchmark --image frame.jpg --runs 3
+"""
+import sys
+import time
+import base64
+import argparse
+import subprocess
+import numpy as np
+import requests
+from benchmarks.common import report
+
+API_URL = 'http://127.0.0.1:5000'
+
+
+def wait_for(check, timeout_sec):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_sec:
+        try:
+            if check():
+                return time.perf_counter()
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError('The API did not start in time')
+
+
+def cold_start(image, timeout_sec):
+    launched = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'api.py'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        serving = wait_for(lambda: requests.get(f'{API_URL}/analysis').ok, timeout_sec)
+        ready = wait_for(lambda: requests.get(f'{API_URL}/ready').ok, timeout_sec)
+        response = requests.post(f'{API_URL}/analysis', json={'image': image})
+        response.raise_for_status()
+        detected = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait()
+    return {'firstResponseSec': serving - launched, 'readySec': ready - launched,
+            'firstDetectionSec': detected - launched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', required=True, help='JPEG frame sent as the first detection request')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as frame:
+        image = base64.b64encode(frame.read()).decode()
+    runs = [cold_start(image, args.timeout) for _ in range(args.runs)]
+    report('startup', {key: float(np.median([run[key] for run in runs])) for key in runs[0]}, args.output)
+
+
+if __name__ == '__main__':
+    main()
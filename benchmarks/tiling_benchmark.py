@@ -0,0 +1,76 @@
+"""Reports the latency and the recall of the whole frame detection against tiled layouts on a set of
+   annotated sample frames. The annotations file maps every frame to its ground truth boxes:
+   {"loc75.jpg": [{"label": "car", "box": [x0, y0, x1, y1]}, ...]}
+   Recall is also reported for the small objects only (box area below --small-area pixels).
+
+   python -m benchmarks.tiling_benchmark frames/ frames/annotations.json --layouts 1x1 2x2 2x3 3x3
+"""
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+from yolo import YOLO
+from tiling import detect_tiled
+from benchmarks.common import measure, summarize, report
+
+
+def box_iou(boxes, box):
+    x0 = np.maximum(boxes[:, 0], box[0])
+    y0 = np.maximum(boxes[:, 1], box[1])
+    x1 = np.minimum(boxes[:, 2], box[2])
+    y1 = np.minimum(boxes[:, 3], box[3])
+    intersection = np.maximum(0, x1 - x0 + 1) * np.maximum(0, y1 - y0 + 1)
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    return intersection / (areas + (box[2] - box[0] + 1) * (box[3] - box[1] + 1) - intersection)
+
+
+def recall(detections, truths, min_iou, small_area):
+    """(found, total, small found, small total) for one frame"""
+    found = total = small_found = small_total = 0
+    for truth in truths:
+        box = truth['box']
+        small = (box[2] - box[0]) * (box[3] - box[1]) < small_area
+        same_label = detections.filter_labels([truth['label']])
+        hit = len(same_label) > 0 and box_iou(same_label.boxes, box).max() >= min_iou
+        total += 1
+        found += hit
+        small_total += small
+        small_found += hit and small
+    return found, total, small_found, small_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', help='Directory of the sample frames')
+    parser.add_argument('annotations', help='JSON file of the ground truth boxes')
+    parser.add_argument('--layouts', nargs='+', default=['1x1', '2x2', '2x3', '3x3'], help='ROWSxCOLS')
+    parser.add_argument('--overlap', type=float, default=0.2)
+    parser.add_argument('--min-iou', type=float, default=0.5)
+    parser.add_argument('--small-area', type=int, default=32 * 32)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.annotations) as annotations_file:
+        annotations = json.load(annotations_file)
+    names = sorted(annotations)
+    images = [cv2.cvtColor(cv2.imread(os.path.join(args.frames, name)), cv2.COLOR_BGR2RGB) for name in names]
+    yolo = YOLO()
+
+    results = {}
+    for layout_name in args.layouts:
+        rows, cols = map(int, layout_name.split('x'))
+        layout = None if rows * cols == 1 else {'rows': rows, 'cols': cols, 'overlap': args.overlap}
+        run = lambda: [detect_tiled(yolo, [image], [layout])[0] for image in images]
+        detections = run()
+        found, total, small_found, small_total = np.sum(
+            [recall(frame, annotations[name], args.min_iou, args.small_area) for frame, name in zip(detections, names)],
+            axis=0)
+        results[layout_name] = dict(summarize(measure(run, args.repeat), items=len(images)),
+                                    recall=float(found / total) if total else None,
+                                    smallObjectRecall=float(small_found / small_total) if small_total else None)
+    report('tiling', results)
+
+
+if __name__ == '__main__':
+    main()
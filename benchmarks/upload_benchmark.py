@@ -0,0 +1,51 @@
+"""Compares the base64 JSON upload of /analysis with the raw image/jpeg upload of /analysis/image on a
+   directory of camera frames: request size, decode latency and peak memory of the decoding.
+
+   python -m benchmarks.upload_benchmark frames/
+"""
+import glob
+import json
+import base64
+import argparse
+import cv2
+import numpy as np
+from PIL import Image
+from io import BytesIO
+from benchmarks.common import measure, summarize, peak_memory, report
+
+
+def decode_base64_json(body):
+    """The decoding done for a POST /analysis request"""
+    payload = json.loads(body)
+    image = Image.open(BytesIO(base64.b64decode(payload['image'])))
+    return cv2.cvtColor(np.array(image), cv2.COLOR_BGR2RGB)
+
+
+def decode_raw(body):
+    """The decoding done for a POST /analysis/image request"""
+    return cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('frames', help='Directory of JPEG camera frames')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    raw_bodies = []
+    for path in sorted(glob.glob(f'{args.frames}/*.jpg')):
+        with open(path, 'rb') as frame:
+            raw_bodies.append(frame.read())
+    json_bodies = [json.dumps({'image': base64.b64encode(body).decode()}).encode() for body in raw_bodies]
+
+    results = {}
+    for name, decode, bodies in [('base64_json', decode_base64_json, json_bodies), ('raw_jpeg', decode_raw, raw_bodies)]:
+        results[name] = dict(summarize(measure(lambda: [decode(body) for body in bodies], args.repeat),
+                                       items=len(bodies)),
+                             requestBytes=int(np.mean([len(body) for body in bodies])),
+                             peakMemoryBytes=peak_memory(lambda: [decode(body) for body in bodies]))
+    report('upload', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from fetcher import ImageFetcher
+
+
+class TTLCache:
+    """Thread safe LRU cache bounded by the total size of its values.
+       Entries older than `ttl_sec` are reported as misses by `get`. They stay available to
+       `peek(include_expired=True)` (e.g. for revalidating a frame) until the LRU evicts them.
+    """
+
+    def __init__(self, max_bytes, ttl_sec):
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[2] > self.ttl_sec:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, include_expired=False):
+        """Returns the value without updating the recency or the hit/miss counters"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (not include_expired and time.monotonic() - entry[2] > self.ttl_sec):
+                return None
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.monotonic())
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hitRatio': self.hits / lookups if lookups else 0.}
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+
+class FrameCache:
+    """Shared cache of the latest decoded camera frames and of their YOLO detections.
+       The frames are keyed by URL and kept for `frame_ttl_sec`. The detections are keyed by the URL plus the
+       ETag/Last-Modified of the frame they were computed on, so a camera that has not changed is never
+       detected twice. Expired frames are revalidated with a conditional GET and reused on a 304.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, frame_ttl_sec=60, detection_ttl_sec=600, fetcher=None):
+        self.frames = TTLCache(max_bytes, frame_ttl_sec)
+        self.detections = TTLCache(max_bytes // 16, detection_ttl_sec)
+        self.fetcher = fetcher or ImageFetcher()
+
+    def fetch(self, url):
+        """Returns a private copy of the decoded frame, downloading it only when the cached one has expired
+           and the camera has published a new image since."""
+        entry = self.frames.get(url)
+        if entry is None:
+            stale = self.frames.peek(url, include_expired=True)
+            image, validator = self.fetcher.fetch(url, stale[0] if stale else None)
+            entry = (validator, stale[1]) if image is None else (validator, image)
+            self.frames.put(url, entry, entry[1].nbytes)
+        return entry[1].copy()
+
+    def detection_key(self, url):
+        """The key of the detections of the frame currently cached for the url"""
+        entry = self.frames.peek(url)
+        return None if entry is None else (url, entry[0])
+
+    def get_detections(self, key):
+        detections = self.detections.get(key)
+        return None if detections is None else copy.deepcopy(detections)
+
+    def put_detections(self, key, detections):
+        size = detections.boxes.nbytes + detections.scores.nbytes + detections.label_ids.nbytes + 256
+        self.detections.put(key, copy.deepcopy(detections), size)
+
+    def stats(self):
+        return {'frames': self.frames.stats(), 'detections': self.detections.stats(), 'http': self.fetcher.stats()}
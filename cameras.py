@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CAMERAS_URL = 'https://data.calgary.ca/api/views/6fv8-ymsc/rows.json'
+CAMERA_COLUMNS = ('id', 'address', 'region', 'latitude', 'longitude')
+
+
+class CameraRegistry:
+    """Keeps the list of the traffic cameras in a local JSON file, so a restart doesn't depend on the open data
+       portal. The list is downloaded again once the file is older than `max_age_sec`, and a stale file is
+       still used when the download fails.
+    """
+
+    def __init__(self, session, path='cameras.json', max_age_sec=86400, url=CAMERAS_URL):
+        self.session = session
+        self.path = path
+        self.max_age_sec = max_age_sec
+        self.url = url
+
+    def load(self):
+        """Returns the cameras and the ones that are new or changed since the cached list"""
+        cached = self._read()
+        if cached is not None and time.time() - os.path.getmtime(self.path) < self.max_age_sec:
+            return cached, []
+        try:
+            cameras = self.download()
+        except Exception as err:
+            if cached is None:
+                raise
+            logger.error(f'Failed to download the camera list, using the cached one: {err}')
+            return cached, []
+        self._write(cameras)
+        previous = {camera['id']: camera for camera in cached or []}
+        changed = [camera for camera in cameras if previous.get(camera['id']) != camera]
+        removed = previous.keys() - {camera['id'] for camera in cameras}
+        if removed:
+            logger.info(f'Cameras no longer listed: {sorted(removed)}')
+        # The database may have missed the changes of a previous run, so a first download upserts everything
+        return cameras, changed if cached is not None else cameras
+
+    def download(self):
+        cameras = []
+        response = self.session.get(self.url)
+        response.raise_for_status()
+        for location in response.json()['data']:
+            cameras.append({
+                'address': location[8],
+                'image_url': location[10][0],
+                'id': int(location[10][0].split('/')[-1].split('.')[0][3:]),
+                'region': location[9],
+                'latitude': float(location[12]),
+                'longitude': float(location[11]),
+            })
+        return cameras
+
+    def _read(self):
+        try:
+            with open(self.path) as registry:
+                return json.load(registry)
+        except FileNotFoundError:
+            return None
+        except ValueError as err:
+            logger.error(f'Ignoring the corrupted camera registry {self.path}: {err}')
+            return None
+
+    def _write(self, cameras):
+        # Written next to the registry and renamed, so a crash never leaves a truncated file
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as registry:
+            json.dump(cameras, registry)
+        os.replace(temporary, self.path)
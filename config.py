@@ -24,3 +24,126 @@ class Config:
     @property
     def postgres_password(self):
         return self._env_var("POSTGRES_DATABASE_PASSWORD", required=True)
+
+    @property
+    def postgres_pool_min_size(self):
+        # The pool closes the connections returned while it already holds this many idle ones, so a smaller
+        # value trades a new connection (and new prepared statements) per request under load for fewer idle ones
+        return int(self._env_var("POSTGRES_POOL_MIN_SIZE", self.postgres_pool_max_size))
+
+    @property
+    def postgres_pool_max_size(self):
+        return int(self._env_var("POSTGRES_POOL_MAX_SIZE", 10))
+
+    @property
+    def postgres_health_check_sec(self):
+        return float(self._env_var("POSTGRES_HEALTH_CHECK_SEC", 30))
+
+    @property
+    def fetch_workers(self):
+        return int(self._env_var("FETCH_WORKERS", 8))
+
+    @property
+    def inference_workers(self):
+        return int(self._env_var("INFERENCE_WORKERS", 1))
+
+    @property
+    def prefetch_queue_size(self):
+        return int(self._env_var("PREFETCH_QUEUE_SIZE", 16))
+
+    @property
+    def inference_batch_size(self):
+        return int(self._env_var("INFERENCE_BATCH_SIZE", 8))
+
+    @property
+    def batch_window_ms(self):
+        return float(self._env_var("BATCH_WINDOW_MS", 10))
+
+    @property
+    def frame_cache_max_mb(self):
+        return int(self._env_var("FRAME_CACHE_MAX_MB", 256))
+
+    @property
+    def frame_cache_ttl_sec(self):
+        return float(self._env_var("FRAME_CACHE_TTL_SEC", 60))
+
+    @property
+    def detection_cache_ttl_sec(self):
+        return float(self._env_var("DETECTION_CACHE_TTL_SEC", 600))
+
+    @property
+    def http_pool_size(self):
+        return int(self._env_var("HTTP_POOL_SIZE", 16))
+
+    @property
+    def http_timeout_sec(self):
+        return float(self._env_var("HTTP_TIMEOUT_SEC", 10))
+
+    @property
+    def frame_change_threshold(self):
+        return float(self._env_var("FRAME_CHANGE_THRESHOLD", 2.0))
+
+    @property
+    def inference_backend(self):
+        return self._env_var("INFERENCE_BACKEND", "darkflow")
+
+    @property
+    def inference_processes(self):
+        return int(self._env_var("INFERENCE_PROCESSES", 0))
+
+    @property
+    def inference_worker_memory_mb(self):
+        # Resident size of a worker process with a loaded model, e.g. YOLOv2 on darkflow
+        return int(self._env_var("INFERENCE_WORKER_MEMORY_MB", 1536))
+
+    @property
+    def detection_threshold(self):
+        return float(self._env_var("DETECTION_THRESHOLD", 0.12))
+
+    @property
+    def tiling_config(self):
+        return self._env_var("TILING_CONFIG")
+
+    @property
+    def scheduler_mode(self):
+        return self._env_var("SCHEDULER_MODE", "fixed")
+
+    @property
+    def inference_budget_per_minute(self):
+        return int(self._env_var("INFERENCE_BUDGET_PER_MINUTE", 120))
+
+    @property
+    def min_poll_interval_sec(self):
+        return float(self._env_var("MIN_POLL_INTERVAL_SEC", 60))
+
+    @property
+    def max_poll_interval_sec(self):
+        return float(self._env_var("MAX_POLL_INTERVAL_SEC", 1800))
+
+    @property
+    def metrics_port(self):
+        return int(self._env_var("METRICS_PORT", 9101))
+
+    @property
+    def profiler_interval_ms(self):
+        return float(self._env_var("PROFILER_INTERVAL_MS", 0))
+
+    @property
+    def profiler_output(self):
+        return self._env_var("PROFILER_OUTPUT", "profile.folded")
+
+    @property
+    def model_warm_up(self):
+        return self._env_var("MODEL_WARM_UP", "true").lower() == "true"
+
+    @property
+    def camera_registry_path(self):
+        return self._env_var("CAMERA_REGISTRY_PATH", "cameras.json")
+
+    @property
+    def camera_registry_max_age_sec(self):
+        return int(self._env_var("CAMERA_REGISTRY_MAX_AGE_SEC", 86400))
+
+    @property
+    def archive_path(self):
+        return self._env_var("ARCHIVE_PATH")
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class Detections:
+    """Array backed detections of one frame: an Nx4 array of (x0, y0, x1, y1) pixel boxes, the scores and the ids
+       of the labels in `labels`. All the filtering and the per label statistics are vectorized; the list of
+       dicts used by the JSON responses is only built by `to_dicts`.
+    """
+
+    def __init__(self, boxes, scores, label_ids, labels):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32).reshape(-1)
+        self.labels = labels
+
+    @classmethod
+    def from_dicts(cls, detections, labels):
+        """Builds the arrays from the list of dicts format"""
+        label_index = {label: index for index, label in enumerate(labels)}
+        boxes = [(item['topleft']['x'], item['topleft']['y'], item['bottomright']['x'], item['bottomright']['y'])
+                 for item in detections]
+        return cls(boxes, [float(item['confidence']) for item in detections],
+                   [label_index[item['label']] for item in detections], labels)
+
+    @classmethod
+    def concatenate(cls, frames, labels):
+        return cls(np.concatenate([frame.boxes for frame in frames]) if frames else np.zeros((0, 4)),
+                   np.concatenate([frame.scores for frame in frames]) if frames else [],
+                   np.concatenate([frame.label_ids for frame in frames]) if frames else [], labels)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, index):
+        """New detections with the rows picked by a boolean mask or an array of indices"""
+        return Detections(self.boxes[index], self.scores[index], self.label_ids[index], self.labels)
+
+    def filter_labels(self, labels):
+        ids = [index for index, label in enumerate(self.labels) if label in labels]
+        return self.select(np.isin(self.label_ids, ids))
+
+    def filter_threshold(self, threshold):
+        return self.select(self.scores >= threshold)
+
+    def nms(self, iou_threshold):
+        return self.select(non_max_suppression(self.boxes, self.scores, self.label_ids, iou_threshold))
+
+    def shifted(self, dx, dy):
+        """The same detections with the boxes moved by (dx, dy), e.g. from tile to frame coordinates"""
+        return Detections(self.boxes + [dx, dy, dx, dy], self.scores, self.label_ids, self.labels)
+
+    def counts(self):
+        """Number of detections per label, for the labels that were detected"""
+        counts = np.bincount(self.label_ids, minlength=len(self.labels))
+        return {self.labels[index]: int(counts[index]) for index in np.flatnonzero(counts)}
+
+    def mean_confidence(self):
+        """Average score per label, for the labels that were detected"""
+        counts = np.bincount(self.label_ids, minlength=len(self.labels))
+        totals = np.bincount(self.label_ids, weights=self.scores, minlength=len(self.labels))
+        return {self.labels[index]: float(totals[index] / counts[index]) for index in np.flatnonzero(counts)}
+
+    def centers(self):
+        return (self.boxes[:, :2] + 0.5 * (self.boxes[:, 2:] - self.boxes[:, :2])).astype(np.float64)
+
+    def label_names(self):
+        return [self.labels[index] for index in self.label_ids]
+
+    def to_dicts(self, confidence_as_string=False):
+        """The list of dicts format of the API responses"""
+        confidences = self.scores.tolist()
+        if confidence_as_string:
+            confidences = [str(confidence) for confidence in confidences]
+        return [{
+            "label": label,
+            "confidence": confidence,
+            "topleft": {"x": x0, "y": y0},
+            "bottomright": {"x": x1, "y": y1}
+        } for label, confidence, (x0, y0, x1, y1) in zip(self.label_names(), confidences, self.boxes.tolist())]
+
+
+def non_max_suppression(boxes, scores, label_ids, iou_threshold):
+    """Class-wise NMS.Returns the indices of the kept boxes, highest score first"""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Shifting every class into its own coordinate range so boxes of different classes never overlap
+    boxes = boxes.astype(np.float64) + (label_ids * (boxes.max() + 1))[:, None]
+    areas = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.maximum(0, np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]) + 1)
+        height = np.maximum(0, np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]) + 1)
+        intersection = width * height
+        iou = intersection / (areas[best] + areas[rest] - intersection)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
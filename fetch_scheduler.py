@@ -1,132 +1,166 @@
-import requests
 import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime
 import time
-from collections import defaultdict
+import asyncio
 from dateutil import tz
-from flask import Flask
-from services import ImageAnalysisService, Database, HistoricalImagePoinst
+from services import ImageAnalysisService
 from config import Config
+from pipeline import FetchDetectPipeline
+from cache import FrameCache
+from gating import FrameChangeDetector
+from workers import build_detector
+from tiling import TilingConfig
+from adaptive import AdaptiveSchedule
+from async_scheduler import AsyncScheduler
+from fetcher import ImageFetcher
+from ingestion import detection_rows, copy_rows, TARGET_LABELS, COUNT_COLUMNS, LOCATION_COLUMNS
+from rollups import update_rollups, migrate as migrate_rollups
+from cameras import CameraRegistry, CAMERA_COLUMNS
+from archive import DetectionArchive
+import metrics
 import logging
 
-logging.basicConfig(format='%(asctime)-15s %(message)s')
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-app = Flask(__name__)
 config = Config()
-image_service = ImageAnalysisService()
-database = Database(config)
-historical_detections = HistoricalImagePoinst(database)
-TARGET_LABELS = ['car', 'person', 'truck', 'bus', 'train', 'bicycle', 'motorbike', 'cat', 'dog']
 
 
 class Postgres:
     def __init__(self):
         self.connect()
-        self.cursor.execute('DELETE FROM camera')
+        # Every count insert also updates the rollups, so their tables have to exist before the first sweep
+        migrate_rollups(self.cursor)
         self.conn.commit()
+        self.ensure_camera_index()
 
     def connect(self):
         self.conn = psycopg2.connect(host="localhost", database="azure_ai", user="postgres", password="postgres")
         self.cursor = self.conn.cursor()
 
-    def insert_camera(self, camera):
-        self.cursor.execute(
-            f"INSERT INTO camera (id,address,region,latitude,longitude) VALUES({camera['id']}, '{camera['address']}', '{camera['region']}', {camera['latitude']}, {camera['longitude']})")
+    def ensure_camera_index(self):
+        """Creates the unique index on camera.id that the upserts rely on. The cameras used to be deleted and
+           reinserted on every start, so the duplicates such a run may have left are removed first."""
+        self.cursor.execute("SELECT pg_advisory_xact_lock(hashtext('camera_id_unique'))")
+        self.cursor.execute("SELECT to_regclass('camera_id_unique') IS NULL")
+        if self.cursor.fetchone()[0]:
+            self.cursor.execute("DELETE FROM camera a USING camera b WHERE a.id = b.id AND a.ctid < b.ctid")
+            self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS camera_id_unique ON camera (id)")
+            logger.info('Created the unique index on camera.id')
+        self.conn.commit()
 
+    def has_cameras(self):
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM camera)")
+        has_cameras = self.cursor.fetchone()[0]
         self.conn.commit()
-        logger.info(f"Inserted camera: {camera['id']}")
+        return has_cameras
 
-    def insert(self, query):
-        try:
-            self.cursor.execute(query)
-            self.conn.commit()
-        except Exception as err:
-            logger.error(f'Exception while trying to commit to the database:  {err}')
-            self.connect()
+    def upsert_cameras(self, cameras):
+        """Inserts the new cameras and updates the changed ones in one statement"""
+        execute_values(
+            self.cursor,
+            f"INSERT INTO camera ({','.join(CAMERA_COLUMNS)}) VALUES %s ON CONFLICT (id) DO UPDATE "
+            f"SET {', '.join(f'{column} = excluded.{column}' for column in CAMERA_COLUMNS[1:])}",
+            [tuple(camera[column] for column in CAMERA_COLUMNS) for camera in cameras])
+        self.conn.commit()
+        logger.info(f'Upserted {len(cameras)} cameras')
 
-    def multi_insert(self, queries):
+    def bulk_insert(self, table, columns, rows, retries=1, on_copy=None):
+        """Copies the rows into the table in one round trip.On failure it reconnects and retries the batch.
+           `on_copy(cursor, rows)` runs in the same transaction, right after the copy."""
         try:
-            for query in queries:
-                self.cursor.execute(query)
-            self.conn.commit()
+            with metrics.timed('db_write'):
+                copy_rows(self.cursor, table, columns, rows)
+                if on_copy:
+                    on_copy(self.cursor, rows)
+                self.conn.commit()
         except Exception as err:
-            logger.error(f'Exception while trying to multi commit to the database:  {err}')
+            logger.error(f'Exception while trying to bulk insert into {table}:  {err}')
             self.connect()
+            if retries > 0:
+                self.bulk_insert(table, columns, rows, retries - 1, on_copy)
 
 
 class Scheduler:
     def __init__(self):
         self.database = Postgres()
+        self.frame_cache = FrameCache(max_bytes=config.frame_cache_max_mb * 2 ** 20,
+                                      frame_ttl_sec=config.frame_cache_ttl_sec,
+                                      detection_ttl_sec=config.detection_cache_ttl_sec,
+                                      fetcher=ImageFetcher(pool_size=config.http_pool_size,
+                                                           timeout_sec=config.http_timeout_sec))
+        # The model loads in the background while the first frames are downloaded
+        self.image_service = ImageAnalysisService(yolo=build_detector(config), frame_cache=self.frame_cache)
+        self.session = self.frame_cache.fetcher.session
+        self.registry = CameraRegistry(self.session, config.camera_registry_path, config.camera_registry_max_age_sec)
         self.cameras = self.get_camera_locations()
-        self.insert_cameras(self.cameras)
-        self.session = requests.Session()
         self.detection_url = 'http://127.0.0.1:5000/analysis'
         self.FETCHING_INTERVAL_SEC = 300
+        self.pipeline = FetchDetectPipeline(self.fetch_image, self.detect_images,
+                                            fetch_workers=config.fetch_workers,
+                                            inference_workers=config.inference_workers,
+                                            queue_size=config.prefetch_queue_size,
+                                            batch_size=config.inference_batch_size)
+        self.frame_changes = FrameChangeDetector(threshold=config.frame_change_threshold)
+        self.last_predictions = {}
+        self.tiling = TilingConfig(config.tiling_config)
+        self.archive = DetectionArchive(config.archive_path) if config.archive_path else None
 
     def insert_cameras(self, cameras):
-        for camera in cameras:
-            self.database.insert_camera(camera)
+        if cameras:
+            self.database.upsert_cameras(cameras)
 
     def insert_detections(self, detections):
-        # insert into counts
-        location_queries = []
-        count_queries = []
-        for detection in detections:
-            confidences = detection['countsConfidence']
-            # Creating counts queries
-            for object_type, count in detection['counts'].items():
-                if object_type not in TARGET_LABELS:
-                    continue
-                confidence = confidences[object_type]
-                counts = f"INSERT INTO count (camera_id , time,label,count, confidence) VALUES({detection['camera']['id']},'{detection['time']}','{object_type}',{count},{confidence})"
-                count_queries.append(counts)
+        count_rows, location_rows = detection_rows(detections, TARGET_LABELS)
 
-            # Creating individual objects queries
-            for item in detection["detection"]:
-                if item['label'] not in TARGET_LABELS:
-                    continue
-                x0 = item['topleft']['x']
-                y0 = item['topleft']['y']
-                x1 = item['bottomright']['x']
-                y1 = item['bottomright']['y']
-                xc = x0 + 0.5 * (x1 - x0)
-                yc = y0 + 0.5 * (y1 - y0)
-                query = f"INSERT INTO object_location (camera_id ,time  ,label  , x_top_left ,y_top_left  ,x_bottom_right , y_bottom_right ,x_center , y_center ,confidence  ) " \
-                        f"VALUES ({detection['camera']['id']},'{detection['time']}' , '{item['label']}',{x0},{y0} ,{x1} ,{y1} ,{xc},{yc},{item['confidence']} )"
-                location_queries.append(query)
-
-        if count_queries:
-            self.database.multi_insert(count_queries)
-            logger.info(f'Inserted {len(count_queries)} records into the count table')
-
-        if location_queries:
-            self.database.multi_insert(location_queries)
-            logger.info(f'Inserted {len(location_queries)} records into objects_location table')
+        if count_rows:
+            self.database.bulk_insert('count', COUNT_COLUMNS, count_rows, on_copy=update_rollups)
+            logger.info(f'Inserted {len(count_rows)} records into the count table')
+
+        if location_rows:
+            self.database.bulk_insert('object_location', LOCATION_COLUMNS, location_rows)
+            logger.info(f'Inserted {len(location_rows)} records into objects_location table')
+
+        if self.archive:
+            self.archive_detections(detections)
+
+    def archive_detections(self, detections):
+        """Appends the detections to the Parquet archive. A failure is logged without failing the sweep,
+           the database stays the source of truth."""
+        try:
+            rows = self.archive.append(detections)
+            logger.info(f'Archived {rows} detections')
+        except Exception as err:
+            logger.error(f'Failed to archive the detections: {err}', exc_info=True)
 
     def get_camera_locations(self):
-        cameras = []
-        response = requests.get('https://data.calgary.ca/api/views/6fv8-ymsc/rows.json')
-        locations = response.json()['data']
-        for location in locations:
-            cameras.append({
-                'address': location[8],
-                'image_url': location[10][0],
-                'id': int(location[10][0].split('/')[-1].split('.')[0][3:]),
-                'region': location[9],
-                'latitude': float(location[12]),
-                'longitude': float(location[11]),
-            })
+        """The cameras of the local registry.Only the cameras that changed since it was last refreshed are
+           written to the database, or all of them when the database has none yet (e.g. a new database)."""
+        cameras, changed = self.registry.load()
+        self.insert_cameras(changed if self.database.has_cameras() else cameras)
+        self.cameras_loaded_at = time.monotonic()
         return cameras
 
+    def refresh_cameras(self):
+        """Reloads the registry once it is older than its max age, so a long running scheduler picks up the new
+           and changed cameras.Returns whether the cameras were reloaded."""
+        if time.monotonic() - self.cameras_loaded_at < config.camera_registry_max_age_sec:
+            return False
+        self.cameras = self.get_camera_locations()
+        logger.info(f'Refreshed the camera registry: {len(self.cameras)} cameras')
+        return True
+
     def run(self):
         while True:
             try:
                 start_time = datetime.now()
+                self.refresh_cameras()
                 detections = self.fetch_images()
                 self.insert_detections(detections)
 
                 elapsed_time = (datetime.now() - start_time).total_seconds()
+                metrics.SWEEP_SECONDS.observe(elapsed_time)
+                metrics.record_startup('first_sweep')
                 waiting_time = self.FETCHING_INTERVAL_SEC - elapsed_time
                 logger.info(f'Elapsed time: {elapsed_time}')
                 logger.info(f'Waiting time: {waiting_time}')
@@ -138,29 +172,86 @@ class Scheduler:
                 logger.error(f'Exception happened :{err} , Time : {datetime.now().isoformat()}',exc_info=True)
                 
 
-    def fetch_images(self):
-        detections = []
-        for camera_id, camera in enumerate(self.cameras):
-            counts = defaultdict(int)
-            confidence = defaultdict(float)
-            logger.info(f'Fetching camera {camera_id}/{len(self.cameras)}')
-            prediction = image_service.detect({
-                "image": camera['image_url']
-            })
-            detection = prediction['detections']
-            for item in detection:
-                counts[item['label']] += 1
-                confidence[item['label']] += float(item['confidence'])
-            # Average confidence per group
-            for key, value in confidence.items():
-                confidence[key] = value / counts[key]
-            utc_time = datetime.now(tz=tz.UTC)
-            calgary_time = utc_time.astimezone(tz.gettz('America/Edmonton')).isoformat()
-            detections.append(
-                {"camera": camera, "detection": detection, "counts": counts, "countsConfidence": confidence,
-                 "time": calgary_time})
+    def run_adaptive(self):
+        """Polls every camera on its own adaptive schedule instead of sweeping all of them at a fixed interval"""
+        schedule = AdaptiveSchedule(self.cameras, base_interval_sec=self.FETCHING_INTERVAL_SEC,
+                                    min_interval_sec=config.min_poll_interval_sec,
+                                    max_interval_sec=config.max_poll_interval_sec,
+                                    budget_per_minute=config.inference_budget_per_minute)
+        while True:
+            try:
+                if self.refresh_cameras():
+                    schedule.update_cameras(self.cameras)
+                due = schedule.due()
+                if not due:
+                    time.sleep(min(schedule.next_due_in(), 1))
+                    continue
+                counts = {}
+                try:
+                    detections = [detection for _, detection in self.pipeline.run([camera for camera, _ in due])]
+                    self.insert_detections(detections)
+                    counts = {detection['camera']['id']: len(detection['detection']) for detection in detections}
+                    metrics.record_startup('first_sweep')
+                finally:
+                    # due() popped the cameras, they go back in the schedule even when the poll raised.
+                    # The ones without stored detections are recorded as failed polls.
+                    polled_at = time.time()
+                    for camera, scheduled_time in due:
+                        schedule.record(camera['id'], scheduled_time, polled_at, counts.get(camera['id']))
 
+                lags = schedule.lag_report()
+                logger.info(f'Polled {len(due)} cameras, worst recent lag: '
+                            f'{max(lag["max"] for lag in lags.values()):.1f} sec')
+                logger.debug(f'Poll lag per camera: {lags}')
+            except Exception as err:
+                logger.error(f'Exception happened :{err} , Time : {datetime.now().isoformat()}', exc_info=True)
+
+    def fetch_images(self):
+        logger.info(f'Fetching {len(self.cameras)} cameras')
+        detections = [detection for _, detection in self.pipeline.run(self.cameras)]
+        logger.info(f'Reused the previous detections for {self.frame_changes.skip_rate():.1%} of the frames so far')
+        logger.debug(f'Skip rate per camera: {self.frame_changes.skip_rates()}')
         return detections
 
+    def fetch_image(self, camera):
+        with metrics.labels(camera=camera['id']):
+            return self.image_service.load_image({"image": camera['image_url']})
+
+    def detect_images(self, cameras, images):
+        """Runs YOLO on the frames that changed since their last detection, the others reuse
+           the previous detections of their camera stamped with the current time"""
+        # A camera without previous detections is detected whatever its frame, without counting as a skip
+        thumbnails = [self.frame_changes.changed(camera['id'], image, force=camera['id'] not in self.last_predictions)
+                      for camera, image in zip(cameras, images)]
+        changed = [index for index, thumbnail in enumerate(thumbnails) if thumbnail is not None]
+        if changed:
+            predictions = self.image_service.analyze_images([images[index] for index in changed],
+                                                       [self.detection_request(cameras[index]) for index in changed])
+            for index, prediction in zip(changed, predictions):
+                self.last_predictions[cameras[index]['id']] = prediction
+                self.frame_changes.update(cameras[index]['id'], thumbnails[index])
+        with metrics.timed('post_process'):
+            return [self.summarize(camera, self.last_predictions[camera['id']]) for camera in cameras]
+
+    def detection_request(self, camera):
+        return {"image": camera['image_url'], "tiles": self.tiling.layout(camera['id'])}
+
+    def summarize(self, camera, detections):
+        utc_time = datetime.now(tz=tz.UTC)
+        calgary_time = utc_time.astimezone(tz.gettz('America/Edmonton')).isoformat()
+        metrics.FRAMES.labels(camera=camera['id']).inc()
+        return {"camera": camera, "detection": detections, "counts": detections.counts(),
+                "countsConfidence": detections.mean_confidence(), "time": calgary_time}
 
-Scheduler().run()
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)-15s %(message)s')
+    metrics.set_default_labels(endpoint='scheduler')
+    if config.metrics_port:
+        metrics.serve(config.metrics_port)
+    metrics.start_profiler(config)
+    if config.scheduler_mode == 'adaptive':
+        Scheduler().run_adaptive()
+    elif config.scheduler_mode == 'async':
+        asyncio.run(AsyncScheduler(Scheduler(), config, TARGET_LABELS).run())
+    else:
+        Scheduler().run()
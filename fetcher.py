@@ -0,0 +1,74 @@
+import cv2
+import hashlib
+import threading
+import requests
+import numpy as np
+from requests.adapters import HTTPAdapter
+from metrics import timed
+
+
+class ImageFetcher:
+    """Downloads the camera images over a pooled keep-alive session.
+       Requests are conditional (If-None-Match/If-Modified-Since) when the validators of the previous frame
+       are known, so an unchanged camera costs a 304 without a body and no decoding.
+    """
+
+    def __init__(self, pool_size=16, timeout_sec=10):
+        self.timeout_sec = timeout_sec
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.downloads = 0
+        self.not_modified = 0
+        self.downloaded_bytes = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, url, validator=None):
+        """Returns the decoded RGB image and its validator.The image is None when the server reports
+           that the frame has not changed since `validator`."""
+        with timed('fetch'):
+            response = self.session.get(url, headers=conditional_headers(validator), timeout=self.timeout_sec)
+        if response.status_code == 304:
+            with self.lock:
+                self.not_modified += 1
+            return None, validator
+        response.raise_for_status()
+        with self.lock:
+            self.downloads += 1
+            self.downloaded_bytes += len(response.content)
+        return decode_image(response.content), response_validator(response.headers, response.content)
+
+    def stats(self):
+        with self.lock:
+            return {'downloads': self.downloads, 'notModified': self.not_modified,
+                    'downloadedBytes': self.downloaded_bytes}
+
+
+def conditional_headers(validator):
+    """The If-None-Match/If-Modified-Since headers of a validator returned by a previous fetch"""
+    headers = {}
+    if validator:
+        etag, last_modified, _ = validator
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def response_validator(headers, content):
+    """(ETag, Last-Modified, content digest). The digest is only computed when the server sends neither header"""
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    digest = None if etag or last_modified else hashlib.md5(content).hexdigest()
+    return etag, last_modified, digest
+
+
+def decode_image(buffer):
+    """Decodes the JPEG straight from the response buffer into an RGB array"""
+    with timed('decode'):
+        image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('The response is not a valid image')
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
@@ -0,0 +1,52 @@
+import cv2
+import threading
+import numpy as np
+from collections import defaultdict
+
+
+class FrameChangeDetector:
+    """Decides whether a camera view has changed enough since its last detected frame to be worth running YOLO.
+       Frames are compared as small grayscale thumbnails by their mean absolute difference (0-255 scale).
+       The reference thumbnail is only replaced by a changed frame once it has been detected, so a slow drift
+       still triggers a detection once it adds up past the threshold, and a failed detection is retried.
+    """
+
+    def __init__(self, threshold=2.0, thumbnail_size=(32, 32)):
+        self.threshold = threshold
+        self.thumbnail_size = thumbnail_size
+        self.references = {}
+        self.frames = defaultdict(int)
+        self.skipped = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def changed(self, camera_id, image, force=False):
+        """Returns the thumbnail of the frame when it changed since the reference of the camera (or when `force`),
+           None when the previous detections can be reused. The thumbnail only becomes the new reference once it
+           is passed to `update`, after the frame was detected."""
+        thumbnail = self._thumbnail(image)
+        with self.lock:
+            self.frames[camera_id] += 1
+            reference = self.references.get(camera_id)
+            if not force and reference is not None and self.threshold > 0 and \
+                    np.mean(np.abs(thumbnail - reference)) < self.threshold:
+                self.skipped[camera_id] += 1
+                return None
+            return thumbnail
+
+    def update(self, camera_id, thumbnail):
+        with self.lock:
+            self.references[camera_id] = thumbnail
+
+    def skip_rates(self):
+        """Fraction of the frames of every camera that reused the previous detections"""
+        with self.lock:
+            return {camera_id: self.skipped[camera_id] / frames for camera_id, frames in self.frames.items()}
+
+    def skip_rate(self):
+        with self.lock:
+            frames = sum(self.frames.values())
+            return sum(self.skipped.values()) / frames if frames else 0.
+
+    def _thumbnail(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.float32)
@@ -0,0 +1,37 @@
+import csv
+import io
+
+# The labels stored by the scheduler and the replay
+TARGET_LABELS = ['car', 'person', 'truck', 'bus', 'train', 'bicycle', 'motorbike', 'cat', 'dog']
+COUNT_COLUMNS = ('camera_id', 'time', 'label', 'count', 'confidence')
+LOCATION_COLUMNS = ('camera_id', 'time', 'label', 'x_top_left', 'y_top_left', 'x_bottom_right', 'y_bottom_right',
+                    'x_center', 'y_center', 'confidence')
+
+
+def detection_rows(detections, target_labels):
+    """Flattens the sweep detections into the rows of the count and object_location tables"""
+    count_rows = []
+    location_rows = []
+    for detection in detections:
+        camera_id = detection['camera']['id']
+        confidences = detection['countsConfidence']
+        for object_type, count in detection['counts'].items():
+            if object_type not in target_labels:
+                continue
+            count_rows.append((camera_id, detection['time'], object_type, count, confidences[object_type]))
+
+        objects = detection['detection'].filter_labels(target_labels)
+        for label, (x0, y0, x1, y1), (xc, yc), confidence in zip(objects.label_names(), objects.boxes.tolist(),
+                                                                 objects.centers().tolist(), objects.scores.tolist()):
+            location_rows.append((camera_id, detection['time'], label, x0, y0, x1, y1, xc, yc, confidence))
+    return count_rows, location_rows
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Streams the rows into the table with a single COPY FROM STDIN round trip.
+       The values travel as CSV data, never as SQL text.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
@@ -3,8 +3,8 @@
 import cv2
 import numpy as np
 from yolo import YOLO
+from rendering import render_detections, encode_jpeg
 from flask import Flask
-import pandas as pd
 from flask import request
 import json
 from PIL import Image
@@ -59,13 +59,13 @@ def detect_objects():
 
     if input_image_format =='url':
         image_url = request_params['image']
-        detected_objets = camera.detect(image_url, input_image_format)
         RGB_image=io.imread(image_url)
+        detected_objets = camera.detect(RGB_image)
     elif input_image_format =='image':
          base64_encoded_image_string = request_params['image']
          BGR_image =Image.open(BytesIO(base64.b64decode(base64_encoded_image_string)))
          RGB_image=cv2.cvtColor(np.array(BGR_image), cv2.COLOR_BGR2RGB)
-         detected_objets=camera.detect(RGB_image, input_image_format)
+         detected_objets=camera.detect(RGB_image)
     else:
         return "Invalid request"
 
@@ -85,9 +85,7 @@ def format_result(output_format,output_minify,RGB_image,detected_objets):
     if output_format=='json':
         return jasonify(detected_objets,output_minify)
     elif output_format=='image':
-        base64Image=str(generate_output_image(RGB_image, detected_objets))
-        base64Image=base64Image[2:]
-        base64Image=base64Image[:-1]
+        base64Image=generate_output_image(RGB_image, detected_objets).decode('ascii')
         response={
             "image":base64Image,
             "objects":jasonify(detected_objets,True)
@@ -98,8 +96,7 @@ def format_result(output_format,output_minify,RGB_image,detected_objets):
 
 def generate_output_image(original_image, detected_objects):
     overlayed_image =draw_objects_boundaries(original_image, detected_objects)
-    RGB_image = cv2.cvtColor(np.array(overlayed_image), cv2.COLOR_BGR2RGB)
-    return encode_base64(RGB_image)
+    return base64.b64encode(encode_jpeg(overlayed_image))
 
 
 def draw_objects_boundaries (input_image, detected_objects):
@@ -111,34 +108,17 @@ def draw_objects_boundaries (input_image, detected_objects):
     :return: original image with boundary box drawn around
      the detected objects.
     """
-    image={}
-    for i in range(len(detected_objects)):
-        topLeft = (detected_objects[i]['topleft']['x'], detected_objects[i]['topleft']['y'])
-        bottomRight = (detected_objects[i]['bottomright']['x'], detected_objects[i]['bottomright']['y'])
-        label = detected_objects[i]['label']
-        image = cv2.rectangle(input_image, topLeft, bottomRight, (0, 255, 0), 2)
-        image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
-        image = cv2.putText(input_image, label, topLeft, cv2.FONT_HERSHEY_COMPLEX, 1, (0, 0, 0), 2)
-    return image
+    return render_detections(input_image, detected_objects, draw_labels=True, swap_channels=True)
 
 def encode_base64(image):
     retval, buffer = cv2.imencode('.jpg', image)
     return base64.b64encode(buffer)
 
 
-def jasonify(input,output_minify):
-    results=pd.Series(input).to_json(orient='values');
+def jasonify(detections,output_minify):
     if not output_minify:
-        return results
-    minified={}
-    results=json.loads(results)
-    for result in results:
-        label=result['label']
-        if label in minified:
-            minified[label]= minified[label]+1
-        else:
-            minified[label]=1
-    return json.dumps(minified)
+        return json.dumps(detections.to_dicts())
+    return json.dumps(detections.counts())
 
 def get_image_format(params):
     if 'http' in params['image']:
@@ -0,0 +1,158 @@
+import os
+import sys
+import atexit
+import time
+import logging
+import threading
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, start_http_server, CONTENT_TYPE_LATEST
+
+logger = logging.getLogger(__name__)
+
+# The stages are fetch, decode, inference, post_process, encode, db_write and db_query
+LABELS = ('stage', 'camera', 'endpoint')
+
+STAGE_SECONDS = Histogram('trafficcam_stage_seconds', 'Time spent in each processing stage', LABELS,
+                          buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+STAGE_ERRORS = Counter('trafficcam_stage_errors_total', 'Processing stages that raised an exception', LABELS)
+REQUEST_SECONDS = Histogram('trafficcam_request_seconds', 'Latency of the API requests', ('endpoint', 'status'))
+SWEEP_SECONDS = Histogram('trafficcam_sweep_seconds', 'Duration of the scheduler sweeps',
+                          buckets=(1, 5, 10, 30, 60, 120, 180, 300, 600))
+FRAMES = Counter('trafficcam_frames_total', 'Camera frames processed by the scheduler', ('camera',))
+STARTUP_SECONDS = Gauge('trafficcam_startup_seconds', 'Seconds from the process start to a startup milestone',
+                        ('milestone',))
+
+_defaults = {'camera': '', 'endpoint': ''}
+_context = threading.local()
+
+
+def set_default_labels(**labels):
+    """Labels of the stages timed outside any `labels` block, e.g. endpoint='scheduler' for the whole process"""
+    _defaults.update({key: str(value) for key, value in labels.items()})
+
+
+def set_thread_labels(**labels):
+    """Replaces the labels of the stages timed by the current thread, e.g. for the duration of a web request"""
+    _context.labels = {key: str(value) for key, value in labels.items()}
+
+
+@contextmanager
+def labels(**labels):
+    """Labels the stages timed by the current thread inside the block, e.g. with the camera being fetched"""
+    previous = getattr(_context, 'labels', {})
+    set_thread_labels(**{**previous, **labels})
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+
+def current_labels(**labels):
+    return {**_defaults, **getattr(_context, 'labels', {}), **{key: str(value) for key, value in labels.items()}}
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Observes the duration of the block in the stage histogram and counts it as an error if it raises.
+       The camera and endpoint labels come from the `labels` blocks of the thread unless given here."""
+    values = current_labels(stage=stage, **labels)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(**values).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(**values).observe(time.perf_counter() - start)
+
+
+def _process_started_at():
+    """Start time of the process from /proc on Linux, otherwise the time this module was imported"""
+    try:
+        with open('/proc/self/stat') as stat:
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as stat:
+            boot_time = next(int(line.split()[1]) for line in stat if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+_started_at = _process_started_at()
+_milestones = set()
+
+
+def record_startup(milestone):
+    """Records and logs the time from the process start to the first occurrence of a milestone,
+       e.g. the first served request"""
+    if milestone in _milestones:
+        return
+    _milestones.add(milestone)
+    elapsed = time.time() - _started_at
+    STARTUP_SECONDS.labels(milestone=milestone).set(elapsed)
+    logger.info(f'Cold start: {milestone} after {elapsed:.2f} sec')
+
+
+def latest():
+    """The exposition of all the metrics and its content type, for a /metrics route"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def serve(port):
+    """Exposes /metrics on a sidecar HTTP port, for the processes without a web app"""
+    start_http_server(port)
+    logger.info(f'Serving the metrics on port {port}')
+
+
+class SamplingProfiler:
+    """Samples the stacks of all the threads every `interval_ms` and periodically writes the counts in the
+       folded format of flamegraph.pl/speedscope. It only reads sys._current_frames, so it can stay enabled
+       on a live process at a small cost."""
+
+    def __init__(self, output, interval_ms=10, flush_sec=60):
+        self.output = output
+        self.interval_sec = interval_ms / 1000
+        self.flush_sec = flush_sec
+        self.stacks = StackCounter()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        # The sampling thread is a daemon, the samples since its last periodic flush are written at exit
+        atexit.register(self.flush)
+        logger.info(f'Sampling the stacks every {self.interval_sec * 1000:.0f} ms into {self.output}')
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        flushed = time.monotonic()
+        while True:
+            time.sleep(self.interval_sec)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != me:
+                    self.stacks[self._fold(frame)] += 1
+            if time.monotonic() - flushed > self.flush_sec:
+                self.flush()
+                flushed = time.monotonic()
+
+    def _fold(self, frame):
+        names = []
+        while frame is not None:
+            names.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def flush(self):
+        # The sampling thread may add stacks while another thread flushes
+        stacks = self.stacks.copy()
+        with open(self.output, 'w') as output:
+            for stack, count in stacks.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+def start_profiler(config):
+    """Starts the sampling profiler when PROFILER_INTERVAL_MS is set"""
+    if config.profiler_interval_ms > 0:
+        return SamplingProfiler(config.profiler_output, config.profiler_interval_ms).start()
+    return None
@@ -0,0 +1,93 @@
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FetchDetectPipeline:
+    """Two stage pipeline that overlaps the image downloads with the object detection.
+       A pool of I/O workers prefetches the images into a bounded queue while a separate
+       pool of inference workers consumes them. When the queue is full the fetchers block,
+       so a slow inference stage never piles up more than `queue_size` decoded frames in memory.
+       The inference workers drain up to `batch_size` queued frames at a time so they can be
+       detected in a single batched forward pass.
+    """
+    _STOP = object()
+
+    def __init__(self, fetch, detect, fetch_workers=8, inference_workers=1, queue_size=16, batch_size=1):
+        """
+        :param fetch: callable(item) -> image, runs on the I/O workers
+        :param detect: callable(items, images) -> results, runs on the inference workers
+        """
+        self.fetch = fetch
+        self.detect = detect
+        self.fetch_workers = max(1, fetch_workers)
+        self.inference_workers = max(1, inference_workers)
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+
+    def run(self, items):
+        """Runs all the items through both stages and returns the (item, result) pairs in the input order.
+           Items that fail to fetch or detect are logged and left out of the results.
+        """
+        items = list(items)
+        pending = queue.Queue()
+        for index, item in enumerate(items):
+            pending.put((index, item))
+        frames = queue.Queue(maxsize=self.queue_size)
+        results = [None] * len(items)
+
+        fetchers = [threading.Thread(target=self._fetch_worker, args=(pending, frames), daemon=True)
+                    for _ in range(self.fetch_workers)]
+        detectors = [threading.Thread(target=self._detect_worker, args=(frames, results), daemon=True)
+                     for _ in range(self.inference_workers)]
+        for worker in fetchers + detectors:
+            worker.start()
+        for worker in fetchers:
+            worker.join()
+        for _ in detectors:
+            frames.put(self._STOP)
+        for worker in detectors:
+            worker.join()
+
+        return [(item, result) for item, result in zip(items, results) if result is not None]
+
+    def _fetch_worker(self, pending, frames):
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                image = self.fetch(item)
+            except Exception as err:
+                logger.error(f'Failed to fetch {item}: {err}')
+                continue
+            frames.put((index, item, image))
+
+    def _detect_worker(self, frames, results):
+        while True:
+            task = frames.get()
+            if task is self._STOP:
+                return
+            batch = [task]
+            while len(batch) < self.batch_size:
+                try:
+                    task = frames.get_nowait()
+                except queue.Empty:
+                    break
+                if task is self._STOP:
+                    # Leaving the sentinel for the next loop, after the current batch is processed
+                    frames.put(task)
+                    break
+                batch.append(task)
+            self._detect_batch(batch, results)
+
+    def _detect_batch(self, batch, results):
+        indices, items, images = zip(*batch)
+        try:
+            for index, result in zip(indices, self.detect(list(items), list(images))):
+                results[index] = result
+        except Exception as err:
+            logger.error(f'Failed to run the detection on a batch of {len(batch)} items: {err}')
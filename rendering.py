@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+
+
+def render_detections(image, detections, color=(0, 255, 0), width=None, height=None, thickness=2,
+                      draw_labels=False, swap_channels=False):
+    """Draws the detection boxes on a resized copy of the frame.
+       The frame is resized first (keeping its aspect ratio, the width wins when both are given) and every box
+       is scaled and drawn in place on that one buffer, so the cost per box is a rectangle on the small image.
+       The channels are swapped at most once, for the whole frame.
+    """
+    (h, w) = image.shape[:2]
+    if width is not None:
+        ratio = width / float(w)
+    elif height is not None:
+        ratio = height / float(h)
+    else:
+        ratio = 1.
+
+    if ratio == 1.:
+        canvas = image.copy()
+    else:
+        canvas = cv2.resize(image, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+    if swap_channels:
+        cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB, dst=canvas)
+
+    boxes = np.round(detections.boxes * ratio).astype(int).tolist()
+    for x0, y0, x1, y1 in boxes:
+        cv2.rectangle(canvas, (x0, y0), (x1, y1), color, thickness)
+    if draw_labels:
+        for (x0, y0, _, _), label in zip(boxes, detections.label_names()):
+            cv2.putText(canvas, label, (x0, y0), cv2.FONT_HERSHEY_COMPLEX, max(ratio, 0.4), (0, 0, 0), thickness)
+    return canvas
+
+
+def encode_jpeg(image, quality=95):
+    """Encodes the frame once and returns the JPEG bytes"""
+    _, values = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return values.tobytes()
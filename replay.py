@@ -0,0 +1,250 @@
+"""Offline replay of archived camera frames through the detection and ingestion path, e.g. to compare a new
+   model or threshold with the live detections.
+
+   The frames are JPEG files named after their camera and capture time, by default `<camera id>/<time>.jpg` or
+   `loc<camera id>_<time>.jpg` with an ISO 8601 time such as 20261017T120500 (see --pattern). They are split
+   into chunks that a pool of worker processes, each with its own model, decodes and detects in parallel.
+   The rows of every chunk are copied into replay_count and replay_object_location under the run tag, together
+   with the names of its frames in replay_frame, in one transaction. The live tables are never written, and
+   a run that is interrupted resumes with the frames that are not in replay_frame yet.
+
+   python replay.py run frames/ --run-tag yolov2-t0.2 --threshold 0.2
+   python replay.py compare --run-tag yolov2-t0.2
+"""
+import os
+import re
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+import psycopg2
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dateutil import tz, parser as date_parser
+from config import Config
+from fetcher import decode_image
+from ingestion import detection_rows, copy_rows, TARGET_LABELS, COUNT_COLUMNS, LOCATION_COLUMNS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+FRAME_PATTERN = r'(?:loc)?(?P<camera>\d+)[/_-](?P<time>\d{8}T\d{4,6}(?:Z|[+-]\d{2}:?\d{2})?)\.jpe?g$'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replay_run (
+    run_tag text PRIMARY KEY,
+    started_at timestamptz NOT NULL DEFAULT now(),
+    source text NOT NULL,
+    options jsonb NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replay_frame (
+    run_tag text NOT NULL,
+    path text NOT NULL,
+    error text,
+    PRIMARY KEY (run_tag, path)
+);
+CREATE TABLE IF NOT EXISTS replay_count (
+    run_tag text NOT NULL, camera_id int, time timestamptz, label text, count int, confidence double precision
+);
+CREATE TABLE IF NOT EXISTS replay_object_location (
+    run_tag text NOT NULL, camera_id int, time timestamptz, label text, x_top_left int, y_top_left int,
+    x_bottom_right int, y_bottom_right int, x_center double precision, y_center double precision,
+    confidence double precision
+);
+CREATE INDEX IF NOT EXISTS replay_count_run_camera_label_time ON replay_count (run_tag, camera_id, label, time);
+CREATE INDEX IF NOT EXISTS replay_object_location_run_camera_label_time
+    ON replay_object_location (run_tag, camera_id, label, time);
+"""
+
+# Average hourly count per camera and label of the run next to the live one, over the hours the run covers
+COMPARE = """
+WITH run AS (
+    SELECT camera_id, label, date_trunc('hour', time) AS hour, avg(count) AS count
+    FROM replay_count WHERE run_tag = %(run_tag)s GROUP BY 1, 2, 3
+), live AS (
+    SELECT c.camera_id, c.label, date_trunc('hour', c.time) AS hour, avg(c.count) AS count
+    FROM count c JOIN (SELECT DISTINCT camera_id, hour FROM run) r
+      ON c.camera_id = r.camera_id AND c.time >= r.hour AND c.time < r.hour + interval '1 hour'
+    GROUP BY 1, 2, 3
+)
+SELECT camera_id, label, count(*), avg(coalesce(run.count, 0)), avg(coalesce(live.count, 0))
+FROM run FULL JOIN live USING (camera_id, label, hour)
+GROUP BY 1, 2 ORDER BY 1, 2
+"""
+
+_worker = {}
+
+
+def list_frames(root, pattern=FRAME_PATTERN, timezone='America/Edmonton'):
+    """(path relative to root, camera id, capture time) of every frame, ordered by time. A time without an
+       offset is taken in `timezone`."""
+    matcher = re.compile(pattern)
+    default_tz = tz.gettz(timezone)
+    frames = []
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.relpath(os.path.join(directory, name), root)
+            match = matcher.search(path.replace(os.sep, '/'))
+            if match is None:
+                continue
+            captured = date_parser.isoparse(match.group('time'))
+            frames.append((path, int(match.group('camera')), captured if captured.tzinfo else
+                           captured.replace(tzinfo=default_tz)))
+    return sorted(frames, key=lambda frame: (frame[2], frame[1]))
+
+
+def _init_worker(root, options):
+    # The processes already run in parallel, so OpenCV (the decoding and the opencv backend) keeps to one thread
+    # in each of them. TensorFlow still sizes its own thread pools for the darkflow backend.
+    import cv2
+    cv2.setNumThreads(1)
+    from yolo import YOLO
+    from tiling import TilingConfig
+    from services import ImageAnalysisService
+    _worker['root'] = root
+    _worker['service'] = ImageAnalysisService(yolo=YOLO(max_batch_size=options['batch_size'],
+                                                        backend=options['backend'],
+                                                        threshold=options['threshold']))
+    _worker['tiling'] = TilingConfig(options['tiling'])
+    _worker['labels'] = TARGET_LABELS
+
+
+def _process_chunk(frames):
+    """Detects the objects of a chunk of frames in a worker.Returns the count rows, the location rows and
+       the (path, error) of every frame."""
+    images, loaded, outcomes = [], [], []
+    for path, camera_id, captured in frames:
+        try:
+            with open(os.path.join(_worker['root'], path), 'rb') as frame:
+                images.append(decode_image(frame.read()))
+            loaded.append((path, camera_id, captured))
+            outcomes.append((path, None))
+        except Exception as err:
+            outcomes.append((path, repr(err)))
+
+    requests = [{'image': path, 'tiles': _worker['tiling'].layout(camera_id)} for path, camera_id, _ in loaded]
+    predictions = _worker['service'].analyze_images(images, requests) if images else []
+    detections = [{"camera": {'id': camera_id}, "detection": prediction, "counts": prediction.counts(),
+                   "countsConfidence": prediction.mean_confidence(), "time": captured.isoformat()}
+                  for (_, camera_id, captured), prediction in zip(loaded, predictions)]
+    count_rows, location_rows = detection_rows(detections, _worker['labels'])
+    return count_rows, location_rows, outcomes
+
+
+def start_run(conn, run_tag, source, options):
+    """Registers the run, or checks that a resumed run uses the same options.Returns the frames already done."""
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA)
+    cursor.execute("INSERT INTO replay_run (run_tag, source, options) VALUES (%s, %s, %s) "
+                   "ON CONFLICT (run_tag) DO NOTHING", (run_tag, source, json.dumps(options)))
+    cursor.execute("SELECT options FROM replay_run WHERE run_tag = %s", (run_tag,))
+    if cursor.fetchone()[0] != options:
+        raise ValueError(f'The run {run_tag} was started with other options, use a new run tag')
+    cursor.execute("SELECT path FROM replay_frame WHERE run_tag = %s", (run_tag,))
+    done = {path for path, in cursor.fetchall()}
+    conn.commit()
+    return done
+
+
+def write_chunk(conn, run_tag, count_rows, location_rows, outcomes):
+    """Writes the rows of a chunk and marks its frames as done in one transaction"""
+    cursor = conn.cursor()
+    copy_rows(cursor, 'replay_count', ('run_tag',) + COUNT_COLUMNS, [(run_tag,) + row for row in count_rows])
+    copy_rows(cursor, 'replay_object_location', ('run_tag',) + LOCATION_COLUMNS,
+              [(run_tag,) + row for row in location_rows])
+    copy_rows(cursor, 'replay_frame', ('run_tag', 'path', 'error'),
+              [(run_tag, path, error) for path, error in outcomes])
+    conn.commit()
+
+
+def default_processes(worker_memory_mb):
+    """One worker per core, as far as the available memory holds the model of every worker"""
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return os.cpu_count()
+    return max(1, min(os.cpu_count(), available // (worker_memory_mb * 2 ** 20)))
+
+
+def replay(conn, root, run_tag, options, processes=None, chunk_size=64, pattern=FRAME_PATTERN,
+           timezone='America/Edmonton', worker_memory_mb=1536):
+    frames = list_frames(root, pattern, timezone)
+    done = start_run(conn, run_tag, os.path.abspath(root), options)
+    pending = [frame for frame in frames if frame[0] not in done]
+    logger.info(f'{len(frames)} frames found, {len(frames) - len(pending)} already replayed, {len(pending)} to go')
+    chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+    if not chunks:
+        return 0, 0
+
+    processes = processes or default_processes(worker_memory_mb)
+    logger.info(f'Replaying with {processes} worker processes')
+    context = multiprocessing.get_context('spawn')
+    start_time = time.monotonic()
+    replayed = failed = 0
+    # Unlike multiprocessing.Pool, which hangs when a worker is killed (e.g. by the OOM killer while it loads
+    # its model), the executor raises BrokenProcessPool. The chunks written so far are committed, so running
+    # the same command again resumes the run.
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                             initargs=(root, options)) as pool:
+        futures = [pool.submit(_process_chunk, chunk) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                count_rows, location_rows, outcomes = future.result()
+                write_chunk(conn, run_tag, count_rows, location_rows, outcomes)
+                replayed += len(outcomes)
+                failed += sum(1 for _, error in outcomes if error)
+                rate = replayed / (time.monotonic() - start_time)
+                logger.info(f'{replayed}/{len(pending)} frames replayed ({failed} failed), {rate:.1f} frames/sec, '
+                            f'{(len(pending) - replayed) / rate:.0f} sec left')
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return replayed, failed
+
+
+def compare(conn, run_tag):
+    cursor = conn.cursor()
+    cursor.execute(COMPARE, {'run_tag': run_tag})
+    return [{'cameraId': camera_id, 'label': label, 'hours': hours, 'replayAvg': float(replay_avg),
+             'liveAvg': float(live_avg)} for camera_id, label, hours, replay_avg, live_avg in cursor.fetchall()]
+
+
+def main():
+    logging.basicConfig(format='%(asctime)-15s %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['run', 'compare'])
+    parser.add_argument('frames', nargs='?', help='Directory of the archived frames')
+    parser.add_argument('--run-tag', required=True, help='Name the results are stored under')
+    parser.add_argument('--processes', type=int,
+                        help='Worker processes, by default one per core as far as the available memory holds a '
+                             'model per worker (INFERENCE_WORKER_MEMORY_MB each)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='Frames per task and per transaction')
+    parser.add_argument('--pattern', default=FRAME_PATTERN,
+                        help='Regex with the camera and time groups, matched on the path relative to the directory')
+    parser.add_argument('--timezone', default='America/Edmonton', help='Time zone of the times without offset')
+    parser.add_argument('--threshold', type=float, help='YOLO threshold, DETECTION_THRESHOLD by default')
+    parser.add_argument('--backend', help='Inference backend, INFERENCE_BACKEND by default')
+    parser.add_argument('--tiling', help='Tiling config file, TILING_CONFIG by default')
+    args = parser.parse_args()
+
+    config = Config()
+    conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                            user=config.postgres_username, password=config.postgres_password)
+    if args.command == 'compare':
+        print(json.dumps(compare(conn, args.run_tag), indent=2))
+    else:
+        if not args.frames:
+            parser.error('run needs the frames directory')
+        options = {'threshold': args.threshold or config.detection_threshold,
+                   'backend': args.backend or config.inference_backend,
+                   'tiling': args.tiling or config.tiling_config,
+                   'batch_size': config.inference_batch_size}
+        replayed, failed = replay(conn, args.frames, args.run_tag, options, args.processes, args.chunk_size,
+                                  args.pattern, args.timezone, config.inference_worker_memory_mb)
+        logger.info(f'Replayed {replayed} frames, {failed} could not be read')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Hourly and daily rollups of the count table.
+
+   The scheduler adds every sweep to the rollups in the same transaction as the raw rows, so a bucket is up to
+   date as soon as its counts are inserted. Buckets older than the moment the rollups were installed are served
+   from the raw table until the backfill command has aggregated them.
+
+   The scheduler and the API create the rollup tables at startup, `migrate` only does it ahead of them.
+
+   python rollups.py migrate
+   python rollups.py backfill
+"""
+import argparse
+import logging
+import psycopg2
+from psycopg2.extras import execute_values
+from config import Config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ROLLUP_BUCKETS = ('hour', 'day')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS count_rollup (
+    bucket text NOT NULL,
+    time timestamptz NOT NULL,
+    camera_id int NOT NULL,
+    label text NOT NULL,
+    total double precision NOT NULL,
+    samples bigint NOT NULL,
+    PRIMARY KEY (bucket, camera_id, label, time)
+);
+CREATE TABLE IF NOT EXISTS count_rollup_state (
+    installed_at timestamptz NOT NULL,
+    backfilled_until timestamptz,
+    backfilled boolean NOT NULL DEFAULT false
+);
+INSERT INTO count_rollup_state (installed_at) SELECT now() WHERE NOT EXISTS (SELECT 1 FROM count_rollup_state);
+"""
+
+UPSERT = """
+INSERT INTO count_rollup (bucket, time, camera_id, label, total, samples)
+SELECT b.bucket, date_trunc(b.bucket, v.time::timestamptz), v.camera_id, v.label, sum(v.count), count(*)
+FROM (VALUES %s) AS v(camera_id, time, label, count, confidence)
+CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (bucket, camera_id, label, time) DO UPDATE
+SET total = count_rollup.total + excluded.total, samples = count_rollup.samples + excluded.samples
+"""
+
+# Same as UPSERT for asyncpg, with the rows passed as arrays
+UPSERT_ARRAYS = """
+INSERT INTO count_rollup (bucket, time, camera_id, label, total, samples)
+SELECT b.bucket, date_trunc(b.bucket, v.time), v.camera_id, v.label, sum(v.count), count(*)
+FROM unnest($1::int[], $2::timestamptz[], $3::text[], $4::int[]) AS v(camera_id, time, label, count)
+CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (bucket, camera_id, label, time) DO UPDATE
+SET total = count_rollup.total + excluded.total, samples = count_rollup.samples + excluded.samples
+"""
+
+BACKFILL_CHUNK = """
+INSERT INTO count_rollup (bucket, time, camera_id, label, total, samples)
+SELECT b.bucket, date_trunc(b.bucket, c.time), c.camera_id, c.label, sum(c.count), count(*)
+FROM count c CROSS JOIN (VALUES ('hour'), ('day')) AS b(bucket)
+WHERE c.time >= %(start)s AND c.time < %(end)s
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (bucket, camera_id, label, time) DO UPDATE
+SET total = count_rollup.total + excluded.total, samples = count_rollup.samples + excluded.samples
+"""
+
+# $1 bucket, $2 camera id, $3 label, $4 number of records.
+# Complete buckets come from the rollup, the ones that are not backfilled yet (including the partial bucket
+# in which the rollups were installed) are aggregated from the raw table.
+FETCH_COUNTS = """
+WITH state AS (SELECT installed_at, backfilled FROM count_rollup_state LIMIT 1)
+SELECT r.time AS ttime, r.camera_id, r.label, r.total / r.samples
+FROM count_rollup r, state
+WHERE r.bucket = $1 AND r.camera_id = $2 AND r.label = $3
+  AND (state.backfilled OR r.time > date_trunc($1, state.installed_at))
+UNION ALL
+SELECT date_trunc($1, c.time), c.camera_id, c.label, avg(c.count)
+FROM count c, state
+WHERE NOT state.backfilled AND c.camera_id = $2 AND c.label = $3
+  AND c.time < date_trunc($1, state.installed_at) + ('1 ' || $1)::interval
+GROUP BY 1, 2, 3
+ORDER BY ttime DESC LIMIT $4
+"""
+
+# $1 bucket, $2 camera ids, $3 labels, $4 since, $5 until: the average count of every (camera, label, bucket)
+# whose bucket starts in [since, until). Same split between the rollup and the raw table as FETCH_COUNTS.
+FETCH_SERIES = """
+WITH state AS (SELECT installed_at, backfilled FROM count_rollup_state LIMIT 1)
+SELECT r.camera_id, r.label, r.time, r.total / r.samples
+FROM count_rollup r, state
+WHERE r.bucket = $1 AND r.camera_id = ANY($2::int[]) AND r.label = ANY($3::text[])
+  AND r.time >= $4::timestamptz AND r.time < $5::timestamptz
+  AND (state.backfilled OR r.time > date_trunc($1, state.installed_at))
+UNION ALL
+SELECT c.camera_id, c.label, date_trunc($1, c.time), avg(c.count)
+FROM count c, state
+WHERE NOT state.backfilled AND c.camera_id = ANY($2::int[]) AND c.label = ANY($3::text[])
+  AND c.time >= $4::timestamptz
+  AND c.time < least($5::timestamptz, date_trunc($1, state.installed_at) + ('1 ' || $1)::interval)
+GROUP BY 1, 2, 3
+HAVING date_trunc($1, c.time) >= $4::timestamptz
+"""
+
+
+def migrate(cursor):
+    """Creates the rollup tables if they don't exist yet.Processes starting at the same time wait for each other."""
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('count_rollup'))")
+    cursor.execute(SCHEMA)
+
+
+def update_rollups(cursor, count_rows):
+    """Adds freshly inserted count rows (in the ingestion.COUNT_COLUMNS order) to the rollups"""
+    if count_rows:
+        execute_values(cursor, UPSERT, count_rows)
+
+
+async def update_rollups_async(connection, count_rows):
+    """update_rollups for an asyncpg connection"""
+    if count_rows:
+        camera_ids, times, labels, counts, _ = zip(*count_rows)
+        await connection.execute(UPSERT_ARRAYS, list(camera_ids), list(times), list(labels), list(counts))
+
+
+def backfill(conn, chunk='1 month'):
+    """Aggregates the raw rows inserted before the rollups were installed, one committed chunk at a time.
+       An interrupted backfill resumes from the last committed chunk."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT installed_at, backfilled_until, backfilled FROM count_rollup_state")
+    installed_at, backfilled_until, backfilled = cursor.fetchone()
+    if backfilled:
+        logger.info('The rollups are already backfilled')
+        return
+    if backfilled_until is None:
+        cursor.execute("SELECT min(time) FROM count WHERE time < %s", (installed_at,))
+        backfilled_until = cursor.fetchone()[0] or installed_at
+
+    while backfilled_until < installed_at:
+        cursor.execute("SELECT least(%s::timestamptz + %s::interval, %s)", (backfilled_until, chunk, installed_at))
+        end = cursor.fetchone()[0]
+        cursor.execute(BACKFILL_CHUNK, {'start': backfilled_until, 'end': end})
+        cursor.execute("UPDATE count_rollup_state SET backfilled_until = %s", (end,))
+        conn.commit()
+        logger.info(f'Backfilled the rollups until {end}')
+        backfilled_until = end
+
+    cursor.execute("UPDATE count_rollup_state SET backfilled = true")
+    conn.commit()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)-15s %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'backfill'])
+    parser.add_argument('--chunk', default='1 month', help='Time range aggregated per backfill transaction')
+    args = parser.parse_args()
+
+    config = Config()
+    conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                            user=config.postgres_username, password=config.postgres_password)
+    if args.command == 'migrate':
+        migrate(conn.cursor())
+        conn.commit()
+    else:
+        backfill(conn, args.chunk)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
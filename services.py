@@ -1,14 +1,25 @@
 import cv2
+import time
 import base64
-import skimage.io as io
+import threading
+import weakref
 import numpy as np
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
 from PIL import Image
 from io import BytesIO
 from werkzeug.exceptions import BadRequest
 from collections import defaultdict
 from ast import literal_eval as make_tuple
+from datetime import datetime
+from dateutil import tz, parser as date_parser
 from yolo import YOLO
+from cache import FrameCache, TTLCache
+from tiling import detect_tiled
+from rendering import render_detections, encode_jpeg
+from rollups import FETCH_COUNTS, FETCH_SERIES, ROLLUP_BUCKETS, migrate as migrate_rollups
+from metrics import timed
 
 
 class ImageAnalysisService:
@@ -17,16 +28,58 @@ class ImageAnalysisService:
        overlaid object bounding boxes and  their labels.
     """
 
-    def __init__(self):
-        self.yolo = YOLO()
+    def __init__(self, max_batch_size=None, yolo=None, frame_cache=None):
+        self.yolo = yolo or YOLO(max_batch_size=max_batch_size)
+        self.frame_cache = frame_cache or FrameCache()
         self.CONFIDENCE_THRESHOLD = 0.3
         self.DEFAULT_DRAW_COLOR = (0, 255, 0)
+        self.DEFAULT_OUTPUT_WIDTH = 400
+        self.DEFAULT_JPEG_QUALITY = 95
         self.target_labels = ['car', 'person', 'bus', 'truck', 'bicycle', 'motorbike']
 
     def detect(self, request):
         """Detects the object in image using YOLO"""
         return self._run_detection(self._parse_params(request))
 
+    def load_image(self, request):
+        """Downloads or decodes the requested image without running the detection"""
+        return self._parse_image(self._parse_params(request))
+
+    def detect_image(self, image, request):
+        """Detects the objects in an image that has already been loaded by load_image"""
+        params = self._parse_params(request)
+        detections = self._detect(image, params)
+        return self._format_results(image, detections, params)
+
+    def detect_batch(self, requests):
+        """Detects the objects in several requests with batched YOLO forward passes"""
+        images = [self.load_image(request) for request in requests]
+        return self.detect_images(images, requests)
+
+    def detect_images(self, images, requests):
+        """Batched version of detect_image"""
+        params = [self._parse_params(request) for request in requests]
+        detections = self._detect_many(images, params)
+        return [self._format_results(*args) for args in zip(images, detections, params)]
+
+    def detect_upload(self, buffer, request, binary=False):
+        """Detects the objects in an encoded image uploaded as raw bytes, decoded without intermediate copies.
+           With binary the annotated image is returned as raw JPEG bytes instead of base64."""
+        with timed('decode'):
+            image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise BadRequest('Bad Request: the uploaded file is not a valid image')
+        params = self._parse_params(dict(request, image='upload'))
+        if binary:
+            # Raw bytes can't go in a JSON response, so only the upload route asks for them
+            params.update(createImage=True, imageFormat='jpeg')
+        detections = self._detect(image, params)
+        return self._format_results(image, detections, params)
+
+    def analyze_images(self, images, requests):
+        """Array backed Detections of already loaded images, without formatting them for a response"""
+        return self._detect_many(images, [self._parse_params(request) for request in requests])
+
     def _parse_params(self, payload):
         """Parses the request params"""
         try:
@@ -39,6 +92,18 @@ class ImageAnalysisService:
                 default_params['drawRGBColor'] = make_tuple(payload['drawRGBColor'])
             else:
                 default_params['drawRGBColor'] = self.DEFAULT_DRAW_COLOR
+            default_params['tiles'] = payload.get('tiles')
+            default_params['imageFormat'] = payload.get('imageFormat', 'base64')
+            default_params['outputWidth'] = int(payload.get('outputWidth', self.DEFAULT_OUTPUT_WIDTH))
+            default_params['jpegQuality'] = int(payload.get('jpegQuality', self.DEFAULT_JPEG_QUALITY))
+            if default_params['tiles'] and not {'rows', 'cols'} <= set(default_params['tiles']):
+                raise ValueError('tiles must have rows and cols')
+            if default_params['imageFormat'] != 'base64':
+                raise ValueError('imageFormat must be base64, binary JPEG is only returned by output=jpeg')
+            if default_params['outputWidth'] <= 0:
+                raise ValueError('outputWidth must be positive')
+            if not 0 <= default_params['jpegQuality'] <= 100:
+                raise ValueError('jpegQuality must be between 0 and 100')
 
             return default_params
 
@@ -47,50 +112,72 @@ class ImageAnalysisService:
 
     def _run_detection(self, params):
         image = self._parse_image(params)
-        detections = self.yolo.detect(image)
+        detections = self._detect(image, params)
         return self._format_results(image, detections, params)
 
+    def _detect(self, image, params):
+        """Runs YOLO unless the detections of this exact camera frame are already cached"""
+        return self._detect_many([image], [params])[0]
+
+    def _detect_many(self, images, params):
+        keys = [self._detection_key(item) for item in params]
+        detections = [self.frame_cache.get_detections(key) if key else None for key in keys]
+        missing = [index for index, detection in enumerate(detections) if detection is None]
+        if missing:
+            layouts = [params[index]['tiles'] for index in missing]
+            with timed('inference'):
+                if any(layouts):
+                    results = detect_tiled(self.yolo, [images[index] for index in missing], layouts)
+                else:
+                    results = self.yolo.detect_batch([images[index] for index in missing])
+            for index, detection in zip(missing, results):
+                detections[index] = detection
+                if keys[index]:
+                    self.frame_cache.put_detections(keys[index], detection)
+        return detections
+
+    def _detection_key(self, params):
+        if params['image'].startswith('http'):
+            key = self.frame_cache.detection_key(params['image'])
+            tiles = params['tiles'] and tuple(sorted(params['tiles'].items()))
+            return key and key + (tiles,)
+        return None
+
     def _parse_image(self, params):
         if params['image'].startswith('http'):
-            return io.imread(params['image'])
+            return self.frame_cache.fetch(params['image'])
         else:
-            bgr_encoded_image = Image.open(BytesIO(base64.b64decode(params['image'])))
-            rgb_encoded_image = cv2.cvtColor(np.array(bgr_encoded_image), cv2.COLOR_BGR2RGB)
+            with timed('decode'):
+                bgr_encoded_image = Image.open(BytesIO(base64.b64decode(params['image'])))
+                rgb_encoded_image = cv2.cvtColor(np.array(bgr_encoded_image), cv2.COLOR_BGR2RGB)
             return rgb_encoded_image
 
     def _format_results(self, image, detections, params):
 
         if params['createImage']:
-            image = self._draw_objects(image, detections, params)
-            image = self.base64_encoded(image)
+            with timed('post_process'):
+                image = self._draw_objects(image, detections, params)
+            with timed('encode'):
+                image = encode_jpeg(image, params['jpegQuality'])
+                if params['imageFormat'] != 'jpeg':
+                    image = base64.b64encode(image)
         else:
             image = None
 
-        if params['summerize']:
-            detections = self._group_detections(detections)
-        else:
-            for detection in detections:
-                detection['confidence'] = str(detection['confidence'])
+        with timed('post_process'):
+            if params['summerize']:
+                detections = self._group_detections(detections)
+            else:
+                detections = detections.to_dicts(confidence_as_string=True)
 
         return {'detections': detections, 'image': image}
 
     def _group_detections(self, detections):
-        groups = defaultdict(int)
-        for detection in detections:
-            if detection['label'] in self.target_labels:
-                groups[detection['label']] += 1
-        return groups
+        return detections.filter_labels(self.target_labels).counts()
 
     def _draw_objects(self, image, detections, params):
-
-        for detection in detections:
-            if detection['label'] in self.target_labels and detection['confidence'] >= params['confidenceThreshold']:
-                point_top_left = (detection['topleft']['x'], detection['topleft']['y'])
-                point_bottom_right = (detection['bottomright']['x'], detection['bottomright']['y'])
-                image = cv2.rectangle(image, point_top_left, point_bottom_right, params['drawRGBColor'], 2)
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = image_resize(image, height=200, width=400)
-        return image
+        detections = detections.filter_labels(self.target_labels).filter_threshold(params['confidenceThreshold'])
+        return render_detections(image, detections, params['drawRGBColor'], width=params['outputWidth'])
 
     def base64_encoded(self, image):
         _, values = cv2.imencode('.jpg', image)
@@ -98,47 +185,150 @@ class ImageAnalysisService:
 
 
 class Database:
-    """Fetches the historical detection results from Postgres database"""
+    """Fetches the historical detection results from Postgres database.
+       Every call checks a connection out of a thread safe pool and runs on its own cursor, so
+       concurrent requests never share a cursor. Broken connections are discarded and replaced.
+    """
+    PREPARED_QUERIES = {
+        'fetch_counts': "select date_trunc($1, time) as ttime, camera_id, label, avg(count) from public.count "
+                        "where camera_id=$2 and label=$3 group by 1, camera_id, label order by ttime desc limit $4",
+        'fetch_rollup_counts': FETCH_COUNTS,
+        'object_locations': "select camera_id, label, confidence, x_center::int, y_center::int, time "
+                            "from public.object_location where camera_id=$1 and label=$2 and confidence > $3",
+        'fetch_series': "select camera_id, label, date_trunc($1, time), avg(count) "
+                        "from public.count where camera_id = any($2::int[]) and label = any($3::text[]) "
+                        "and time >= $4::timestamptz and time < $5::timestamptz "
+                        "group by 1, 2, 3 having date_trunc($1, time) >= $4::timestamptz",
+        'fetch_rollup_series': FETCH_SERIES,
+        # The buckets before this one are complete: they end before until, and before the current bucket
+        'finished_until': "select least(date_trunc($1, $2::timestamptz), date_trunc($1, now()))",
+    }
 
     def __init__(self, config):
+        self.health_check_interval = config.postgres_health_check_sec
+        # Keyed by the connection objects, the pool closes and replaces connections whose ids can be reused
+        self.last_used = weakref.WeakKeyDictionary()
+        self.prepared = weakref.WeakKeyDictionary()
+        # The pool raises instead of blocking when it is exhausted, so the callers wait on this semaphore
+        self.available = threading.BoundedSemaphore(config.postgres_pool_max_size)
         try:
-            conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
-                                    user=config.postgres_username, password=config.postgres_password)
-            self.cursor = conn.cursor()
+            self.pool = ThreadedConnectionPool(config.postgres_pool_min_size, config.postgres_pool_max_size,
+                                               host=config.postgres_host, database=config.postgres_database_name,
+                                               user=config.postgres_username, password=config.postgres_password)
+            # The hourly and daily counts are read from the rollups, which the scheduler may not have created yet
+            with self.cursor() as cursor:
+                migrate_rollups(cursor)
         except Exception as err:
             print(f'Failed to connect to Postgres database: {err}')
 
-    def fetch(self, query):
-        self.cursor.execute(query)
-        colnames = [desc[0] for desc in self.cursor.description]
-        return self.cursor.fetchall(), colnames
+    @contextmanager
+    def cursor(self):
+        """Yields a cursor on a pooled connection.The connection goes back to the pool when the block exits"""
+        self.available.acquire()
+        try:
+            conn = self._checkout()
+        except Exception:
+            self.available.release()
+            raise
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._discard(conn)
+            conn = None
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if conn is not None:
+                self.last_used[conn] = time.monotonic()
+                self.pool.putconn(conn)
+            self.available.release()
+
+    def fetch(self, query, params=None):
+        return self._run(lambda cursor: cursor.execute(query, params))
+
+    def fetch_prepared(self, name, params):
+        """Runs one of the PREPARED_QUERIES, preparing its plan once per pooled connection"""
+        return self._run(lambda cursor: self._execute_prepared(cursor, name, params))
 
     def fetch_counts(self, camera_id=75, entity='car', time_bucket='hour', number_of_records=24):
-        """Fetches the  top {} most recent records for the {entity} from the database"""
-        query = f"select date_trunc('{time_bucket}',time) as ttime,camera_id,label, avg(count) from public.count group by date_trunc('{time_bucket}',time) ,camera_id,label having camera_id={camera_id} and label ='{entity}'  order by ttime desc limit {number_of_records};"
-        self.cursor.execute(query)
-        return [[record[0], float(record[-1])] for record in self.cursor.fetchall()]
+        """Fetches the  top {} most recent records for the {entity} from the database.
+           Hourly and daily series are read from the rollups."""
+        query = 'fetch_rollup_counts' if time_bucket in ROLLUP_BUCKETS else 'fetch_counts'
+        records, _ = self.fetch_prepared(query, (time_bucket, camera_id, entity, number_of_records))
+        return [[record[0], float(record[-1])] for record in records]
+
+    def _run(self, execute, retries=1):
+        """Executes on a fresh cursor and reconnects once if the connection was dropped"""
+        try:
+            with timed('db_query'), self.cursor() as cursor:
+                execute(cursor)
+                colnames = [desc[0] for desc in cursor.description]
+                return cursor.fetchall(), colnames
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if retries <= 0:
+                raise
+            return self._run(execute, retries - 1)
+
+    def _execute_prepared(self, cursor, name, params):
+        prepared = self.prepared.setdefault(cursor.connection, set())
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {self.PREPARED_QUERIES[name]}")
+            prepared.add(name)
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+    def _checkout(self):
+        """Gets a healthy connection from the pool.Connections idle for longer than the health check
+           interval are pinged first and replaced if they don't answer."""
+        conn = self.pool.getconn()
+        idle = time.monotonic() - self.last_used.get(conn, 0)
+        if not conn.closed and idle < self.health_check_interval:
+            return conn
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError('connection already closed')
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._discard(conn)
+            return self.pool.getconn()
+
+    def _discard(self, conn):
+        self.prepared.pop(conn, None)
+        self.last_used.pop(conn, None)
+        self.pool.putconn(conn, close=True)
 
 
 class HistoricalImagePoinst:
     """Draws the historical location of detected objects on the Image."""
 
-    def __init__(self, database):
+    def __init__(self, database, frame_cache=None):
         self.database = database
+        self.frame_cache = frame_cache or FrameCache()
         self.image_url = 'http://trafficcam.calgary.ca/loc{}.jpg'
         self.DEFAULT_DRAW_COLOR = (0, 255, 0)
         self.CONFIDENCE_THRESHOLD = 0.3
+        self.DEFAULT_CELL_SIZE = 8
+        self.DEFAULT_HEATMAP_OPACITY = 0.6
+        self.has_downsampled = False
 
     def draw(self, request):
         """Draws a circle at the central detected location of an object """
         params = self._parse_params(request)
-        query = f"select * from public.object_location where camera_id={params['cameraId']} and label='{params['label']}' and confidence >{params['confidenceThreshold']} ;"
-        records, column_names = self.database.fetch(query)
-        image = io.imread(self.image_url.format(params['cameraId']))
-
-        for record in records:
-            color = self._apply_oppacity(params['color'], record[-4])
-            image = cv2.circle(image, (record[-3], record[-2]), 5, color, -1)
+        if params['mode'] == 'heatmap':
+            return self.draw_heatmap(params)
+        records, column_names = self.database.fetch_prepared(
+            'object_locations', (params['cameraId'], params['label'], params['confidenceThreshold']))
+        image = self.frame_cache.fetch(self.image_url.format(params['cameraId']))
+
+        for _, _, confidence, x_center, y_center, _ in records:
+            color = self._apply_oppacity(params['color'], confidence)
+            image = cv2.circle(image, (x_center, y_center), 5, color, -1)
         return self.base64_encoded(image)
 
     def _parse_params(self, request):
@@ -153,20 +343,198 @@ class HistoricalImagePoinst:
                 default_params['color'] = make_tuple(payload['color'])
             else:
                 default_params['color'] = self.DEFAULT_DRAW_COLOR
+            default_params['mode'] = payload.get('mode', 'points')
+            default_params['cellSize'] = int(payload.get('cellSize', self.DEFAULT_CELL_SIZE))
+            default_params['opacity'] = float(payload.get('opacity', self.DEFAULT_HEATMAP_OPACITY))
+            default_params['sampleRate'] = float(payload.get('sampleRate', 1))
+            default_params['since'] = payload.get('since')
+            default_params['until'] = payload.get('until')
+            if default_params['mode'] not in ('points', 'heatmap'):
+                raise ValueError(f"Unknown mode: {default_params['mode']}")
+            if default_params['cellSize'] <= 0 or not 0 < default_params['sampleRate'] <= 1:
+                raise ValueError('cellSize must be positive and sampleRate must be in (0, 1]')
 
             return default_params
 
         except Exception as err:
             raise BadRequest(f"Bad Request: {err}")
 
+    def draw_heatmap(self, params):
+        """Draws the density of the historical object centers as a heatmap blended on the camera frame.
+           The centers are binned into a grid of `cellSize` pixels by the database, so the response
+           time depends on the number of grid cells rather than the number of stored detections.
+        """
+        cells = self._fetch_heatmap_cells(params)
+        image = self.frame_cache.fetch(self.image_url.format(params['cameraId']))
+        height, width = image.shape[:2]
+        cell = params['cellSize']
+        grid = np.zeros((-(-height // cell), -(-width // cell)), dtype=np.float32)
+        if len(cells):
+            cols, rows, counts = cells[:, 0], cells[:, 1], cells[:, 2]
+            inside = (cols >= 0) & (cols < grid.shape[1]) & (rows >= 0) & (rows < grid.shape[0])
+            np.add.at(grid, (rows[inside], cols[inside]), counts[inside])
+
+        heat = np.log1p(grid)
+        if heat.max() > 0:
+            heat = heat / heat.max()
+        heat = cv2.resize((heat * 255).astype(np.uint8), (width, height), interpolation=cv2.INTER_LINEAR)
+        colored = cv2.cvtColor(cv2.applyColorMap(heat, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+        blended = cv2.addWeighted(image, 1 - params['opacity'], colored, params['opacity'], 0)
+        np.copyto(image, blended, where=(heat > 0)[..., None])
+        return self.base64_encoded(image)
+
+    def _fetch_heatmap_cells(self, params):
+        """Returns an array of (column, row, count) of the grid cells that have at least one detection.
+           The locations older than the raw retention are read from their downsampled aggregates."""
+        sample = 'TABLESAMPLE SYSTEM (%(percent)s)' if params['sampleRate'] < 1 else ''
+        where = "where camera_id=%(camera)s and label=%(label)s and confidence > %(threshold)s"
+        if params['since']:
+            where += " and time >= %(since)s"
+        if params['until']:
+            where += " and time < %(until)s"
+        locations = f"select x_center, y_center, 1 as samples from public.object_location {sample} {where}"
+        if self._downsampled_exists():
+            locations += f" union all " \
+                         f"select x_center, y_center, samples from public.object_location_downsampled {sample} {where}"
+        query = f"select floor(x_center / %(cell)s)::int, floor(y_center / %(cell)s)::int, sum(samples)::bigint " \
+                f"from ({locations}) locations group by 1, 2"
+        records, _ = self.database.fetch(query, {
+            'cell': params['cellSize'], 'percent': params['sampleRate'] * 100, 'camera': params['cameraId'],
+            'label': params['label'], 'threshold': params['confidenceThreshold'],
+            'since': params['since'], 'until': params['until'],
+        })
+        return np.array(records, dtype=np.int64).reshape(-1, 3)
+
+    def _downsampled_exists(self):
+        """Whether `python storage.py migrate` has created the downsampled locations.Only a positive answer is
+           cached, so the table is picked up once it is created."""
+        if not self.has_downsampled:
+            records, _ = self.database.fetch("select to_regclass('public.object_location_downsampled') is not null")
+            self.has_downsampled = records[0][0]
+        return self.has_downsampled
+
     def _apply_oppacity(self, color, oppacity):
         color = np.array(color)
         color = color * float(oppacity)
         return tuple(map(int, color))
 
     def base64_encoded(self, image):
-        _, values = cv2.imencode('.jpg', image)
-        return base64.b64encode(values)
+        with timed('encode'):
+            _, values = cv2.imencode('.jpg', image)
+            return base64.b64encode(values)
+
+
+class CountSeries:
+    """Average count time series of many cameras and labels at once, e.g. for a map of all the cameras.
+       All the series of a request are read with one set based query. The finished buckets of every series are
+       cached, so a dashboard refresh only queries the buckets after the cached ones.
+    """
+    BUCKETS = ('minute', 'hour', 'day', 'week', 'month')
+
+    def __init__(self, database, max_bytes=64 * 2 ** 20, ttl_sec=86400):
+        self.database = database
+        # (bucket, camera id, label) -> (covered from, covered until, {bucket start: average count})
+        self.cache = TTLCache(max_bytes, ttl_sec)
+        self.MAX_SERIES = 5000
+
+    def fetch(self, request):
+        params = self._parse_params(request)
+        keys = [(params['bucket'], camera_id, label)
+                for camera_id in params['cameraIds'] for label in params['labels']]
+        series = {key: self._cached(key, params['since'], params['until']) for key in keys}
+        missing = [key for key, (values, start) in series.items() if start is not None]
+
+        query_time = 0.
+        if missing:
+            query_start = time.perf_counter()
+            rows = self._query(params['bucket'], missing, min(series[key][1] for key in missing), params['until'])
+            query_time = time.perf_counter() - query_start
+            # Computed by the database, whose session time zone also defines the day, week and month buckets
+            records, _ = self.database.fetch_prepared('finished_until', (params['bucket'], params['until']))
+            finished_until = records[0][0]
+            fetched = defaultdict(dict)
+            for camera_id, label, bucket_start, average in rows:
+                fetched[(params['bucket'], camera_id, label)][bucket_start] = float(average)
+            for key in missing:
+                values, start = series[key]
+                values.update(fetched[key])
+                self._store(key, start, finished_until, fetched[key])
+        return self._format(params, keys, series, query_time, len(keys) - len(missing))
+
+    def _parse_params(self, request):
+        """Parses the request params"""
+        try:
+            default_params = {}
+            payload = request.get_json(force=True)
+            default_params['cameraIds'] = [int(camera_id) for camera_id in payload['cameraIds']]
+            default_params['labels'] = [str(label) for label in payload.get('labels', ['car'])]
+            default_params['bucket'] = payload.get('bucket', 'hour')
+            default_params['since'] = self._parse_time(payload['since'])
+            default_params['until'] = self._parse_time(payload['until']) if payload.get('until') \
+                else datetime.now(tz=tz.UTC)
+            if default_params['bucket'] not in self.BUCKETS:
+                raise ValueError(f"Unknown bucket: {default_params['bucket']}")
+            if default_params['since'] >= default_params['until']:
+                raise ValueError('since must be before until')
+            if len(default_params['cameraIds']) * len(default_params['labels']) > self.MAX_SERIES:
+                raise ValueError(f'At most {self.MAX_SERIES} camera and label pairs per request')
+
+            return default_params
+
+        except Exception as err:
+            raise BadRequest(f"Bad Request: {err}")
+
+    def _parse_time(self, value):
+        """ISO 8601 timestamp, in UTC unless it has an offset"""
+        value = date_parser.isoparse(value)
+        return value if value.tzinfo else value.replace(tzinfo=tz.UTC)
+
+    def _cached(self, key, since, until):
+        """The cached buckets of the series within [since, until) and the start of the range still to query,
+           None when the cache covers it all"""
+        entry = self.cache.get(key)
+        if entry is None or since < entry[0] or entry[1] <= since:
+            return {}, since
+        covered_from, covered_until, values = entry
+        values = {start: value for start, value in values.items() if since <= start < until}
+        return values, (covered_until if covered_until < until else None)
+
+    def _store(self, key, start, finished_until, fetched):
+        """Caches the finished buckets of [start, finished_until), merged with the cached range it extends"""
+        if finished_until <= start:
+            return
+        values = {bucket: value for bucket, value in fetched.items() if start <= bucket < finished_until}
+        entry = self.cache.peek(key)
+        if entry is not None and entry[0] <= start <= entry[1]:
+            values = {**entry[2], **values}
+            start = entry[0]
+        self.cache.put(key, (start, finished_until, values), 64 * len(values) + 128)
+
+    def _query(self, bucket, keys, since, until):
+        query = 'fetch_rollup_series' if bucket in ROLLUP_BUCKETS else 'fetch_series'
+        camera_ids = sorted({camera_id for _, camera_id, _ in keys})
+        labels = sorted({label for _, _, label in keys})
+        records, _ = self.database.fetch_prepared(query, (bucket, camera_ids, labels, since, until))
+        return records
+
+    def _format(self, params, keys, series, query_time, cached):
+        """Columnar payload: one shared axis of bucket start times (epoch seconds) and for every series its
+           average counts on that axis, null where it has no data"""
+        starts = sorted({start for values, _ in series.values() for start in values})
+        index = {start: position for position, start in enumerate(starts)}
+        payload = []
+        for key in keys:
+            values = [None] * len(starts)
+            for start, value in series[key][0].items():
+                values[index[start]] = round(value, 3)
+            payload.append({'cameraId': key[1], 'label': key[2], 'values': values})
+        return {
+            'bucket': params['bucket'],
+            'times': [int(start.timestamp()) for start in starts],
+            'series': payload,
+            'cachedSeries': cached,
+            'queryTimeMs': round(query_time * 1000, 3),
+        }
 
 
 def image_resize(image, width=None, height=None, inter=cv2.INTER_AREA):
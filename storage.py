@@ -0,0 +1,217 @@
+"""Time partitioned storage and retention of the count and object_location tables.
+
+   `migrate` turns both tables into tables partitioned by range of time (one partition per month or per day).
+   Existing rows are kept in a single legacy partition covering everything before the first regular one.
+   Every partition gets a (camera_id, label, time) index for the per camera reads and a BRIN index on time.
+   Needs PostgreSQL 11 or later, for the indexes on the partitioned tables.
+
+   `maintain` is meant to run from cron (e.g. daily). It creates the partitions of the coming periods, compacts
+   the object_location partitions older than the raw retention into hourly per pixel cell aggregates
+   (object_location_downsampled) before dropping them, drops the count partitions older than the count
+   retention once the rollups hold their aggregates, and deletes the expired aggregates.
+
+   python storage.py migrate --interval month
+   python storage.py maintain
+"""
+import re
+import argparse
+import logging
+import psycopg2
+from config import Config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PARTITION_INTERVALS = ('month', 'day')
+PARTITIONS_AHEAD = {'month': 3, 'day': 14}
+
+TABLES = {
+    'count': "camera_id int, time timestamptz NOT NULL, label text, count int, confidence double precision",
+    # Same column order as the production table, the existing tables are partitioned with their own layout
+    'object_location': "camera_id int, label text, x_top_left int, y_top_left int, x_bottom_right int, "
+                       "y_bottom_right int, confidence double precision, x_center double precision, "
+                       "y_center double precision, time timestamptz NOT NULL",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage_state (
+    partition_interval text NOT NULL
+);
+CREATE TABLE IF NOT EXISTS object_location_downsampled (
+    camera_id int NOT NULL,
+    time timestamptz NOT NULL,
+    label text NOT NULL,
+    x_center int NOT NULL,
+    y_center int NOT NULL,
+    samples bigint NOT NULL,
+    confidence double precision NOT NULL,
+    PRIMARY KEY (camera_id, label, time, x_center, y_center)
+);
+CREATE INDEX IF NOT EXISTS object_location_downsampled_time_brin ON object_location_downsampled USING brin (time);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS {table}_camera_label_time ON {table} (camera_id, label, time);
+CREATE INDEX IF NOT EXISTS {table}_time_brin ON {table} USING brin (time);
+"""
+
+# Object centers of one hour snapped to a grid of %(cell)s pixels, with their number and average confidence
+DOWNSAMPLE = """
+INSERT INTO object_location_downsampled (camera_id, time, label, x_center, y_center, samples, confidence)
+SELECT camera_id, date_trunc('hour', time), label, (floor(x_center / %(cell)s) * %(cell)s + %(cell)s / 2)::int,
+       (floor(y_center / %(cell)s) * %(cell)s + %(cell)s / 2)::int, count(*), avg(confidence)
+FROM {partition}
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (camera_id, label, time, x_center, y_center) DO UPDATE
+SET confidence = (object_location_downsampled.confidence * object_location_downsampled.samples
+                  + excluded.confidence * excluded.samples) / (object_location_downsampled.samples + excluded.samples),
+    samples = object_location_downsampled.samples + excluded.samples
+"""
+
+BOUND = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def migrate(conn, interval='month'):
+    """Partitions the count and object_location tables. Running it again only creates missing partitions."""
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError(f'Unknown partition interval: {interval}')
+    cursor = conn.cursor()
+    cursor.execute(SCHEMA)
+    cursor.execute("SELECT partition_interval FROM storage_state")
+    state = cursor.fetchone()
+    if state and state[0] != interval:
+        raise ValueError(f'The tables are already partitioned by {state[0]}')
+    if not state:
+        cursor.execute("INSERT INTO storage_state (partition_interval) VALUES (%s)", (interval,))
+
+    for table, columns in TABLES.items():
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (f'public.{table}',))
+        kind = cursor.fetchone()
+        if kind is None:
+            cursor.execute(f"CREATE TABLE {table} ({columns}) PARTITION BY RANGE (time)")
+        elif kind[0] == 'r':
+            _partition_existing(cursor, table, interval)
+        cursor.execute(INDEXES.format(table=table))
+        ensure_partitions(cursor, table, interval)
+    conn.commit()
+
+
+def _partition_existing(cursor, table, interval):
+    """Swaps a plain table for a partitioned one, with the existing rows attached as the legacy partition.
+       The legacy partition ends with the current period, so it also receives the rows of the ongoing one."""
+    logger.info(f'Partitioning the {table} table by {interval}')
+    cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"SELECT greatest(date_trunc(%(interval)s, max(time)), date_trunc(%(interval)s, now())) "
+                   f"+ ('1 ' || %(interval)s)::interval FROM {table}", {'interval': interval})
+    boundary = cursor.fetchone()[0]
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (time)")
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy "
+                   f"FOR VALUES FROM (MINVALUE) TO ({_bound(cursor, boundary)})")
+
+
+def _bound(cursor, value):
+    """A partition bound as a plain string literal.Bound parameters arrive as '...'::timestamptz casts,
+       which only PostgreSQL 12 and later accept in partition bounds."""
+    return cursor.mogrify('%s', (value.isoformat(),)).decode()
+
+
+def partitions(cursor, table):
+    """(name, start, end) of the partitions of the table ordered by time. The start of the legacy partition is None."""
+    cursor.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                   "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass", (table,))
+    bounds = []
+    for name, bound in cursor.fetchall():
+        start, end = BOUND.search(bound).groups()
+        cursor.execute("SELECT %s::timestamptz, %s::timestamptz",
+                       (None if start == 'MINVALUE' else start.strip("'"), end.strip("'")))
+        bounds.append((name,) + cursor.fetchone())
+    return sorted(bounds, key=lambda partition: partition[2])
+
+
+def ensure_partitions(cursor, table, interval, ahead=None):
+    """Creates the partitions from the end of the last one up to `ahead` periods after the current one"""
+    ahead = ahead or PARTITIONS_AHEAD[interval]
+    existing = partitions(cursor, table)
+    cursor.execute("SELECT date_trunc(%s, now())", (interval,))
+    start = existing[-1][2] if existing else cursor.fetchone()[0]
+    cursor.execute("SELECT date_trunc(%(interval)s, now()) + %(ahead)s * ('1 ' || %(interval)s)::interval",
+                   {'interval': interval, 'ahead': ahead + 1})
+    horizon = cursor.fetchone()[0]
+    while start < horizon:
+        cursor.execute("SELECT %s::timestamptz + ('1 ' || %s)::interval", (start, interval))
+        end = cursor.fetchone()[0]
+        name = f"{table}_p{start:%Y%m%d}"
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                       f"FOR VALUES FROM ({_bound(cursor, start)}) TO ({_bound(cursor, end)})")
+        logger.info(f'Created the partition {name}')
+        start = end
+
+
+def expired_partitions(cursor, table, retention_days):
+    """The partitions whose rows are all older than the retention"""
+    cursor.execute("SELECT now() - %s * interval '1 day'", (retention_days,))
+    cutoff = cursor.fetchone()[0]
+    return [name for name, _, end in partitions(cursor, table) if end <= cutoff]
+
+
+def maintain(conn, raw_location_days=30, count_days=365, downsampled_days=730, cell_size=4):
+    """Runs the partition creation and the retention.Every dropped partition is its own transaction."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT partition_interval FROM storage_state")
+    interval = cursor.fetchone()[0]
+    for table in TABLES:
+        ensure_partitions(cursor, table, interval)
+    conn.commit()
+
+    for name in expired_partitions(cursor, 'object_location', raw_location_days):
+        cursor.execute(DOWNSAMPLE.format(partition=name), {'cell': cell_size})
+        cursor.execute(f"DROP TABLE {name}")
+        conn.commit()
+        logger.info(f'Downsampled and dropped {name}')
+
+    expired = expired_partitions(cursor, 'count', count_days)
+    cursor.execute("SELECT to_regclass('count_rollup_state') IS NOT NULL")
+    state = None
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT backfilled FROM count_rollup_state")
+        state = cursor.fetchone()
+    if expired and not (state and state[0]):
+        logger.warning(f'Keeping {len(expired)} expired count partitions until the rollups are backfilled')
+        expired = []
+    for name in expired:
+        cursor.execute(f"DROP TABLE {name}")
+        conn.commit()
+        logger.info(f'Dropped {name}')
+
+    cursor.execute("DELETE FROM object_location_downsampled WHERE time < now() - %s * interval '1 day'",
+                   (downsampled_days,))
+    conn.commit()
+    logger.info(f'Deleted {cursor.rowcount} expired downsampled locations')
+
+
+def main():
+    logging.basicConfig(format='%(asctime)-15s %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['migrate', 'maintain'])
+    parser.add_argument('--interval', choices=PARTITION_INTERVALS, default='month', help='Time range per partition')
+    parser.add_argument('--raw-location-days', type=int, default=30,
+                        help='Age after which the object locations are downsampled')
+    parser.add_argument('--count-days', type=int, default=365, help='Age after which the raw counts are dropped')
+    parser.add_argument('--downsampled-days', type=int, default=730,
+                        help='Age after which the downsampled locations are deleted')
+    parser.add_argument('--cell-size', type=int, default=4, help='Pixels per cell of the downsampled locations')
+    args = parser.parse_args()
+
+    config = Config()
+    conn = psycopg2.connect(host=config.postgres_host, database=config.postgres_database_name,
+                            user=config.postgres_username, password=config.postgres_password)
+    if args.command == 'migrate':
+        migrate(conn, args.interval)
+    else:
+        maintain(conn, args.raw_location_days, args.count_days, args.downsampled_days, args.cell_size)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import time
+import unittest
+from adaptive import AdaptiveSchedule, InferenceBudget
+
+
+def schedule(cameras=3, budget_per_minute=2):
+    # No night hours, so the intervals don't depend on when the test runs
+    return AdaptiveSchedule([{'id': camera_id} for camera_id in range(1, cameras + 1)], base_interval_sec=300,
+                            min_interval_sec=60, max_interval_sec=1800, budget_per_minute=budget_per_minute,
+                            night_hours=())
+
+
+def queued(adaptive):
+    return {camera_id: due_at for due_at, camera_id in adaptive.queue}
+
+
+class InferenceBudgetTest(unittest.TestCase):
+
+    def test_grants_at_most_the_tokens_left(self):
+        budget = InferenceBudget(per_minute=2)
+        self.assertEqual(budget.take(5), 2)
+        self.assertEqual(budget.take(1), 0)
+        # One token is refilled every 30 seconds
+        self.assertGreater(budget.next_token_in(), 29)
+
+
+class AdaptiveScheduleTest(unittest.TestCase):
+
+    def test_due_is_limited_by_the_budget(self):
+        adaptive = schedule()
+        later = time.time() + 3600
+        due = adaptive.due(now=later)
+        self.assertEqual([camera['id'] for camera, _ in due], [1, 2])
+        self.assertEqual(adaptive.due(now=later), [])
+        # Camera 3 is overdue, the wait is for the budget instead of a busy loop
+        self.assertGreater(adaptive.next_due_in(now=later), 29)
+
+    def test_failed_poll_is_retried_after_the_base_interval(self):
+        adaptive = schedule()
+        (camera, scheduled), = adaptive.due(now=time.time())
+        adaptive.record(camera['id'], scheduled, 1000.)
+        self.assertEqual(queued(adaptive)[camera['id']], 1300.)
+        self.assertEqual(len(adaptive.counts[camera['id']]), 0)
+
+    def test_quiet_camera_backs_off(self):
+        adaptive = schedule()
+        adaptive.queue = [item for item in adaptive.queue if item[1] != 1]
+        adaptive.record(1, 1000., 1000., total_count=0)
+        self.assertEqual(queued(adaptive)[1], 1300.)
+        adaptive.queue = [item for item in adaptive.queue if item[1] != 1]
+        # Two empty polls in a row double the base interval twice
+        adaptive.record(1, 1300., 1300., total_count=0)
+        self.assertEqual(queued(adaptive)[1], 1300. + 1200.)
+
+    def test_busy_camera_is_polled_more_often(self):
+        adaptive = schedule()
+        for polled_at, count in ((1000., 30), (1300., 10), (1600., 40)):
+            adaptive.queue = [item for item in adaptive.queue if item[1] != 1]
+            adaptive.record(1, polled_at, polled_at, total_count=count)
+        interval = queued(adaptive)[1] - 1600.
+        self.assertGreaterEqual(interval, 60)
+        self.assertLess(interval, 300)
+
+    def test_lag_report(self):
+        adaptive = schedule()
+        adaptive.record(1, 1000., 1012.)
+        self.assertEqual(adaptive.lag_report()[1], {'last': 12., 'max': 12.})
+
+    def test_update_cameras(self):
+        adaptive = schedule()
+        adaptive.update_cameras([{'id': 1}, {'id': 2}, {'id': 4}], now=500.)
+        self.assertEqual(set(queued(adaptive)), {1, 2, 4})
+        self.assertEqual(queued(adaptive)[4], 500.)
+        # A camera removed while it was being polled is not scheduled again
+        adaptive.record(3, 400., 600., total_count=1)
+        self.assertNotIn(3, queued(adaptive))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime, timedelta
+from dateutil import tz
+from services import CountSeries
+
+START = datetime(2026, 1, 1, tzinfo=tz.UTC)
+
+
+def hour(value):
+    return START + timedelta(hours=value)
+
+
+class FakeDatabase:
+    """Runs the prepared series queries of services.Database on in-memory samples of hourly buckets.
+       Every hour h of camera 1 has a count of h at :00 and h + 1 at :30, so a complete bucket averages h + 0.5."""
+
+    def __init__(self, hours=10, now=hour(10)):
+        self.samples = [(hour(value) + timedelta(minutes=minutes), value + minutes // 30)
+                        for value in range(hours) for minutes in (0, 30)]
+        self.now = now
+        self.queries = []
+
+    def fetch_prepared(self, name, params):
+        self.queries.append((name, params))
+        if name == 'finished_until':
+            _, until = params
+            return [(min(self.truncate(until), self.truncate(self.now)),)], ['least']
+        _, camera_ids, labels, since, until = params
+        buckets = {}
+        for time, count in self.samples:
+            if since <= time < until and self.truncate(time) >= since:
+                buckets.setdefault(self.truncate(time), []).append(count)
+        rows = [(1, 'car', start, sum(counts) / len(counts)) for start, counts in sorted(buckets.items())
+                if 1 in camera_ids and 'car' in labels]
+        return rows, ['camera_id', 'label', 'date_trunc', 'avg']
+
+    def series_queries(self):
+        return [params for name, params in self.queries if name != 'finished_until']
+
+    @staticmethod
+    def truncate(time):
+        return time.replace(minute=0, second=0, microsecond=0)
+
+
+class JSONRequest:
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get_json(self, force=False):
+        return self.payload
+
+
+def fetch(series, since, until):
+    result = series.fetch(JSONRequest({'cameraIds': [1], 'labels': ['car'], 'bucket': 'hour',
+                                       'since': since.isoformat(), 'until': until.isoformat()}))
+    values = {datetime.fromtimestamp(time, tz=tz.UTC): value
+              for time, value in zip(result['times'], result['series'][0]['values'])}
+    return values, result['cachedSeries']
+
+
+class CountSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = FakeDatabase()
+        self.series = CountSeries(self.database)
+
+    def test_repeated_refresh_is_served_from_the_cache(self):
+        first, cached = fetch(self.series, hour(0), hour(6))
+        self.assertEqual(first, {hour(value): value + 0.5 for value in range(6)})
+        self.assertEqual(cached, 0)
+        second, cached = fetch(self.series, hour(0), hour(6))
+        self.assertEqual(second, first)
+        self.assertEqual(cached, 1)
+        self.assertEqual(len(self.database.series_queries()), 1)
+
+    def test_refresh_only_queries_the_new_buckets(self):
+        fetch(self.series, hour(0), hour(6))
+        values, _ = fetch(self.series, hour(0), hour(8))
+        self.assertEqual(values, {hour(value): value + 0.5 for value in range(8)})
+        self.assertEqual(self.database.series_queries()[-1][3:], (hour(6), hour(8)))
+
+    def test_earlier_since_is_queried_again(self):
+        fetch(self.series, hour(2), hour(6))
+        values, cached = fetch(self.series, hour(0), hour(6))
+        self.assertEqual(values, {hour(value): value + 0.5 for value in range(6)})
+        self.assertEqual(cached, 0)
+        self.assertEqual(self.database.series_queries()[-1][3:], (hour(0), hour(6)))
+        # The wider range replaced the cached one
+        fetch(self.series, hour(0), hour(6))
+        self.assertEqual(len(self.database.series_queries()), 2)
+
+    def test_unaligned_since_skips_the_partial_bucket(self):
+        values, _ = fetch(self.series, hour(2) + timedelta(minutes=15), hour(6))
+        self.assertEqual(values, {hour(value): value + 0.5 for value in range(3, 6)})
+        # The bucket starting before since was never cached as a partial one
+        values, _ = fetch(self.series, hour(2), hour(6))
+        self.assertEqual(values[hour(2)], 2.5)
+        self.assertEqual(self.database.series_queries()[-1][3:], (hour(2), hour(6)))
+
+    def test_until_in_the_middle_of_a_bucket_is_not_cached(self):
+        values, _ = fetch(self.series, hour(0), hour(6) + timedelta(minutes=15))
+        # Only the :00 sample of the last bucket is before until
+        self.assertEqual(values[hour(6)], 6.)
+        values, _ = fetch(self.series, hour(0), hour(7))
+        self.assertEqual(values[hour(6)], 6.5)
+        self.assertEqual(self.database.series_queries()[-1][3:], (hour(6), hour(7)))
+
+    def test_current_bucket_is_not_cached(self):
+        self.database.now = hour(5) + timedelta(minutes=15)
+        fetch(self.series, hour(0), hour(6))
+        self.database.now = hour(7)
+        fetch(self.series, hour(0), hour(6))
+        self.assertEqual(self.database.series_queries()[-1][3:], (hour(5), hour(6)))
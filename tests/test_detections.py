@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+from detections import Detections, non_max_suppression
+
+LABELS = ['car', 'person']
+
+
+class NonMaxSuppressionTest(unittest.TestCase):
+
+    def test_keeps_the_best_of_overlapping_boxes(self):
+        boxes = np.array([[0, 0, 20, 20], [1, 1, 21, 21], [50, 50, 70, 70]])
+        keep = non_max_suppression(boxes, np.array([0.6, 0.9, 0.8]), np.array([0, 0, 0]), 0.4)
+        self.assertEqual(keep.tolist(), [1, 2])
+
+    def test_never_suppresses_across_labels(self):
+        boxes = np.array([[0, 0, 20, 20], [0, 0, 20, 20]])
+        keep = non_max_suppression(boxes, np.array([0.9, 0.5]), np.array([0, 1]), 0.4)
+        self.assertEqual(keep.tolist(), [0, 1])
+
+    def test_keeps_boxes_below_the_threshold(self):
+        # Intersection 11 x 21 = 231 of a union of 2 * 441 - 231 = 651, an IoU of 0.35
+        boxes = np.array([[0, 0, 20, 20], [10, 0, 30, 20]])
+        keep = non_max_suppression(boxes, np.array([0.9, 0.8]), np.array([0, 0]), 0.4)
+        self.assertEqual(keep.tolist(), [0, 1])
+        keep = non_max_suppression(boxes, np.array([0.9, 0.8]), np.array([0, 0]), 0.3)
+        self.assertEqual(keep.tolist(), [0])
+
+    def test_empty(self):
+        keep = non_max_suppression(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int32), 0.4)
+        self.assertEqual(len(keep), 0)
+
+
+class DetectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.detections = Detections([[0, 0, 10, 10], [5, 5, 15, 15], [20, 20, 40, 40]], [0.9, 0.2, 0.6],
+                                     [0, 0, 1], LABELS)
+
+    def test_counts_and_mean_confidence(self):
+        self.assertEqual(self.detections.counts(), {'car': 2, 'person': 1})
+        confidence = self.detections.mean_confidence()
+        self.assertAlmostEqual(confidence['car'], 0.55, places=5)
+        self.assertAlmostEqual(confidence['person'], 0.6, places=5)
+
+    def test_filters(self):
+        self.assertEqual(len(self.detections.filter_threshold(0.5)), 2)
+        self.assertEqual(self.detections.filter_labels(['person']).boxes.tolist(), [[20, 20, 40, 40]])
+
+    def test_shifted(self):
+        self.assertEqual(self.detections.shifted(100, 50).boxes[0].tolist(), [100, 50, 110, 60])
+
+    def test_to_dicts_round_trip(self):
+        copy = Detections.from_dicts(self.detections.to_dicts(), LABELS)
+        self.assertEqual(copy.boxes.tolist(), self.detections.boxes.tolist())
+        self.assertEqual(copy.label_ids.tolist(), self.detections.label_ids.tolist())
+        np.testing.assert_allclose(copy.scores, self.detections.scores, atol=1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
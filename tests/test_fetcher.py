@@ -0,0 +1,74 @@
+import threading
+import unittest
+import cv2
+import numpy as np
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from fetcher import ImageFetcher
+
+
+def jpeg(value):
+    _, buffer = cv2.imencode('.jpg', np.full((24, 32, 3), value, dtype=np.uint8))
+    return buffer.tobytes()
+
+
+class CameraHandler(BaseHTTPRequestHandler):
+    """Serves the current frame of the server with its ETag, and a 304 when the client already has it"""
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.server.frame)))
+        self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.frame)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        # Port 0 lets the OS pick a free port
+        self.server = HTTPServer(('127.0.0.1', 0), CameraHandler)
+        self.server.requests = []
+        self.server.etag = '"v1"'
+        self.server.frame = jpeg(40)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/loc75.jpg'
+        self.fetcher = ImageFetcher(pool_size=1, timeout_sec=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_conditional_get_sequence(self):
+        image, validator = self.fetcher.fetch(self.url)
+        self.assertEqual(image.shape, (24, 32, 3))
+        self.assertEqual(validator[0], '"v1"')
+        self.assertNotIn('If-None-Match', self.server.requests[-1])
+
+        image, unchanged = self.fetcher.fetch(self.url, validator)
+        self.assertIsNone(image)
+        self.assertEqual(unchanged, validator)
+        self.assertEqual(self.server.requests[-1]['If-None-Match'], '"v1"')
+
+        self.server.etag = '"v2"'
+        self.server.frame = jpeg(200)
+        image, changed = self.fetcher.fetch(self.url, validator)
+        self.assertEqual(image.shape, (24, 32, 3))
+        self.assertGreater(image.mean(), 150)
+        self.assertEqual(changed[0], '"v2"')
+
+        self.assertEqual(self.fetcher.stats()['downloads'], 2)
+        self.assertEqual(self.fetcher.stats()['notModified'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
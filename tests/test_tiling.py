@@ -0,0 +1,60 @@
+import unittest
+import numpy as np
+from detections import Detections
+from tiling import tile_windows, detect_tiled
+
+LABELS = ['car']
+
+
+class FixedBoxDetector:
+    """Finds the same 20 x 20 box in the top left corner of every crop, with a decreasing score"""
+
+    def __init__(self):
+        self.crops = []
+
+    def detect_batch(self, crops):
+        self.crops.extend(crops)
+        return [Detections([[0, 0, 20, 20]], [0.9 - 0.1 * index], [0], LABELS) for index in range(len(crops))]
+
+
+class TileWindowsTest(unittest.TestCase):
+
+    def test_single_tile_is_the_frame(self):
+        self.assertEqual(tile_windows(100, 200, 1, 1), [(0, 0, 200, 100)])
+
+    def test_tiles_cover_the_frame_with_overlap(self):
+        windows = tile_windows(100, 100, 2, 2, overlap=0.2)
+        self.assertEqual(len(windows), 4)
+        # 2 tiles overlapping by 20% of a tile need tiles of ceil(100 / 1.8) = 56 pixels
+        self.assertEqual(windows[0], (0, 0, 56, 56))
+        self.assertEqual(windows[-1], (44, 44, 100, 100))
+        self.assertGreaterEqual(windows[0][2] - windows[1][0], 0.2 * 56)
+        self.assertEqual(windows[1][1], 0)
+
+    def test_tiles_stay_inside_the_frame(self):
+        for x0, y0, x1, y1 in tile_windows(240, 320, 3, 4, overlap=0.3):
+            self.assertTrue(0 <= x0 < x1 <= 320 and 0 <= y0 < y1 <= 240)
+
+
+class DetectTiledTest(unittest.TestCase):
+
+    def test_tile_boxes_are_moved_to_the_frame_and_merged(self):
+        detector = FixedBoxDetector()
+        image = np.zeros((50, 100, 3), dtype=np.uint8)
+        detections, = detect_tiled(detector, [image], [{'rows': 1, 'cols': 2, 'overlap': 0}])
+        # The full frame, then the tiles at x=0 and x=50
+        self.assertEqual([crop.shape[:2] for crop in detector.crops], [(50, 100), (50, 50), (50, 50)])
+        # The box of the first tile is the one of the full frame and is suppressed
+        self.assertEqual(detections.boxes.tolist(), [[0, 0, 20, 20], [50, 0, 70, 20]])
+        np.testing.assert_allclose(detections.scores, [0.9, 0.7], atol=1e-6)
+
+    def test_frames_without_layout_are_detected_whole(self):
+        detector = FixedBoxDetector()
+        images = [np.zeros((50, 100, 3), dtype=np.uint8)] * 2
+        results = detect_tiled(detector, images, [None, None])
+        self.assertEqual(len(detector.crops), 2)
+        self.assertEqual([len(detections) for detections in results], [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
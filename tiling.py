@@ -0,0 +1,56 @@
+import json
+import numpy as np
+from detections import Detections
+
+
+class TilingConfig:
+    """Per camera tile layouts, read from a JSON file such as
+       {"default": null, "cameras": {"75": {"rows": 2, "cols": 3, "overlap": 0.2}}}
+       A layout of null means that the camera is detected on the whole frame only.
+    """
+
+    def __init__(self, path=None):
+        self.default = None
+        self.cameras = {}
+        if path:
+            with open(path) as config_file:
+                layouts = json.load(config_file)
+            self.default = layouts.get('default')
+            self.cameras = {str(camera_id): layout for camera_id, layout in layouts.get('cameras', {}).items()}
+
+    def layout(self, camera_id):
+        return self.cameras.get(str(camera_id), self.default)
+
+
+def tile_windows(height, width, rows, cols, overlap=0.2):
+    """Splits a frame into rows x cols tiles that overlap by the `overlap` fraction of a tile.
+       Returns the (x0, y0, x1, y1) window of every tile."""
+    tile_width = int(np.ceil(width / (cols - (cols - 1) * overlap)))
+    tile_height = int(np.ceil(height / (rows - (rows - 1) * overlap)))
+    xs = np.linspace(0, width - tile_width, cols).astype(int) if cols > 1 else [0]
+    ys = np.linspace(0, height - tile_height, rows).astype(int) if rows > 1 else [0]
+    return [(x, y, min(width, x + tile_width), min(height, y + tile_height)) for y in ys for x in xs]
+
+
+def detect_tiled(detector, images, layouts, iou_threshold=0.4):
+    """Detects the objects of every image on its full frame plus, when it has a layout, on each of its tiles.
+       All the crops of all the images go through the detector as one batch; the tile boxes are moved back
+       to frame coordinates and merged with the full frame boxes by a class-wise NMS.
+    """
+    crops = []
+    origins = []
+    for index, (image, layout) in enumerate(zip(images, layouts)):
+        height, width = image.shape[:2]
+        windows = [(0, 0, width, height)]
+        if layout:
+            windows += tile_windows(height, width, layout['rows'], layout['cols'], layout.get('overlap', 0.2))
+        for x0, y0, x1, y1 in windows:
+            crops.append(image if (x1 - x0, y1 - y0) == (width, height) else
+                         np.ascontiguousarray(image[y0:y1, x0:x1]))
+            origins.append((index, x0, y0))
+
+    frames = [[] for _ in images]
+    for (index, x0, y0), detections in zip(origins, detector.detect_batch(crops)):
+        frames[index].append(detections.shifted(x0, y0))
+    return [Detections.concatenate(parts, parts[0].labels).nms(iou_threshold) if len(parts) > 1 else parts[0]
+            for parts in frames]
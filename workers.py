@@ -0,0 +1,243 @@
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future
+from yolo import YOLO
+from metrics import record_startup
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.7, e.g. the tensorflow 1.14 stack of darkflow: only the in-process detector is available
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+
+class InferencePool:
+    """Pool of worker processes that each load their own YOLO model, so the inference is not bound to one
+       process and its GIL. The decoded frames are copied once into a shared memory block that the worker
+       maps, instead of being pickled through the task queue. Every task goes to the worker with the fewest
+       outstanding tasks. A worker that dies is restarted and its outstanding tasks are sent again.
+       The processes are only started on the first submitted task.
+       It exposes the same detect/detect_batch interface as YOLO, so it can be used as a drop in detector.
+    """
+
+    def __init__(self, processes=2, max_batch_size=None, backend=None, max_attempts=2, monitor_interval_sec=1):
+        self.processes = max(1, processes)
+        self.max_batch_size = max_batch_size
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.monitor_interval_sec = monitor_interval_sec
+        self.context = multiprocessing.get_context('spawn')
+        self.task_ids = itertools.count()
+        self.tasks = {}
+        self.workers = []
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.started = False
+
+    @staticmethod
+    def available():
+        """Whether the pool can run here, the frame transfer needs multiprocessing.shared_memory (Python 3.8)"""
+        return shared_memory is not None
+
+    def detect(self, image):
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        return self.submit(images).result()
+
+    def submit(self, images):
+        """Queues the images as one task and returns a Future of their detections"""
+        self._ensure_started()
+        images = [np.ascontiguousarray(image) for image in images]
+        block = shared_memory.SharedMemory(create=True, size=max(1, sum(image.nbytes for image in images)))
+        specs = []
+        offset = 0
+        for image in images:
+            np.ndarray(image.shape, image.dtype, buffer=block.buf, offset=offset)[...] = image
+            specs.append((offset, image.shape, image.dtype.str))
+            offset += image.nbytes
+
+        task = {'id': next(self.task_ids), 'block': block, 'specs': specs, 'future': Future(), 'attempts': 0}
+        with self.lock:
+            self.tasks[task['id']] = task
+            self._dispatch(task)
+        return task['future']
+
+    def stats(self):
+        with self.lock:
+            return {'processes': self.processes, 'restarts': self.restarts, 'pendingTasks': len(self.tasks),
+                    'outstandingPerWorker': [len(worker['tasks']) for worker in self.workers]}
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.started:
+                return
+            self.results = self.context.Queue()
+            self.workers = [self._start_worker() for _ in range(self.processes)]
+            threading.Thread(target=self._collect, daemon=True).start()
+            threading.Thread(target=self._monitor, daemon=True).start()
+            self.started = True
+
+    def _start_worker(self):
+        tasks = self.context.Queue()
+        process = self.context.Process(target=_work, args=(tasks, self.results, self.max_batch_size, self.backend),
+                                       daemon=True)
+        process.start()
+        return {'process': process, 'queue': tasks, 'tasks': set()}
+
+    def _dispatch(self, task):
+        """Sends the task to the least loaded worker.Must be called with the lock held"""
+        worker = min(self.workers, key=lambda item: len(item['tasks']))
+        worker['tasks'].add(task['id'])
+        task['attempts'] += 1
+        worker['queue'].put((task['id'], task['block'].name, task['specs']))
+
+    def _collect(self):
+        while True:
+            task_id, detections, error = self.results.get()
+            with self.lock:
+                task = self.tasks.pop(task_id, None)
+                for worker in self.workers:
+                    worker['tasks'].discard(task_id)
+            # A task sent again after a worker crash may be answered twice
+            if task is None:
+                continue
+            self._release(task)
+            if error:
+                task['future'].set_exception(RuntimeError(f'Inference worker failed: {error}'))
+            else:
+                task['future'].set_result(detections)
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.monitor_interval_sec)
+            failed = []
+            with self.lock:
+                for index, worker in enumerate(self.workers):
+                    if worker['process'].is_alive():
+                        continue
+                    logger.error(f"Inference worker {worker['process'].pid} died with exit code "
+                                 f"{worker['process'].exitcode}, restarting it")
+                    self.workers[index] = self._start_worker()
+                    self.restarts += 1
+                    for task_id in worker['tasks']:
+                        task = self.tasks[task_id]
+                        if task['attempts'] >= self.max_attempts:
+                            failed.append(self.tasks.pop(task_id))
+                        else:
+                            self._dispatch(task)
+            for task in failed:
+                self._release(task)
+                task['future'].set_exception(RuntimeError('The inference worker crashed while running this task'))
+
+    def _release(self, task):
+        task['block'].close()
+        task['block'].unlink()
+
+
+def _work(tasks, results, max_batch_size, backend):
+    """Worker process loop: maps the frames of every task from shared memory and runs the detection on them"""
+    yolo = YOLO(max_batch_size=max_batch_size, backend=backend)
+    while True:
+        task_id, block_name, specs = tasks.get()
+        # The parent owns the block and unlinks it once the results are back
+        block = shared_memory.SharedMemory(name=block_name)
+        try:
+            images = [np.ndarray(shape, np.dtype(dtype), buffer=block.buf, offset=offset)
+                      for offset, shape, dtype in specs]
+            results.put((task_id, yolo.detect_batch(images), None))
+        except Exception as err:
+            results.put((task_id, None, repr(err)))
+        finally:
+            images = None
+            block.close()
+
+
+class LazyDetector:
+    """Defers building the detector (loading the model) to its first use, or to a background thread started by
+       `warm_up`, so the processes can start serving before the model is loaded. The warm up also runs one
+       inference on a blank frame, which pays the one-off graph and allocation costs before the first request.
+       It exposes the same detect/detect_batch interface as YOLO, so it can be used as a drop in detector.
+    """
+
+    def __init__(self, factory, warm_up_shape=(416, 416, 3)):
+        self.factory = factory
+        self.warm_up_shape = warm_up_shape
+        self.detector = None
+        self.load_sec = None
+        self.warm_up_sec = None
+        self.error = None
+        self.warming = False
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def detect(self, image):
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        detections = self._load().detect_batch(images)
+        self._set_ready()
+        return detections
+
+    def warm_up(self, background=True):
+        """Loads the model and runs one inference, in a daemon thread unless `background` is False.
+           The detector is only reported ready once this inference is done."""
+        self.warming = True
+        if background:
+            threading.Thread(target=self.warm_up, args=(False,), daemon=True).start()
+            return
+        try:
+            detector = self._load()
+            start = time.monotonic()
+            detector.detect(np.zeros(self.warm_up_shape, dtype=np.uint8))
+            self.warm_up_sec = time.monotonic() - start
+            self._set_ready()
+            logger.info(f'Warmed up the detector in {self.warm_up_sec:.2f} sec')
+        except Exception as err:
+            self.error = repr(err)
+            logger.error(f'Failed to warm up the detector: {err}', exc_info=True)
+
+    def status(self):
+        return {'ready': self.ready.is_set(), 'loadSec': self.load_sec, 'warmUpSec': self.warm_up_sec,
+                'error': self.error}
+
+    def _load(self):
+        if self.detector is None:
+            with self.lock:
+                if self.detector is None:
+                    start = time.monotonic()
+                    detector = self.factory()
+                    self.load_sec = time.monotonic() - start
+                    logger.info(f'Loaded the detector in {self.load_sec:.2f} sec')
+                    self.detector = detector
+                    if not self.warming:
+                        self._set_ready()
+        return self.detector
+
+    def _set_ready(self):
+        if not self.ready.is_set():
+            self.ready.set()
+            record_startup('model_ready')
+
+
+def build_detector(config):
+    """The multi-process pool when INFERENCE_PROCESSES is set, otherwise an in-process YOLO.
+       Either is built lazily, and warmed up in the background when MODEL_WARM_UP is set."""
+    if config.inference_processes > 0 and not InferencePool.available():
+        logger.error('INFERENCE_PROCESSES needs Python 3.8 or later, running the inference in process')
+    if config.inference_processes > 0 and InferencePool.available():
+        detector = LazyDetector(lambda: InferencePool(processes=config.inference_processes,
+                                                      max_batch_size=config.inference_batch_size,
+                                                      backend=config.inference_backend))
+    else:
+        detector = LazyDetector(lambda: YOLO(max_batch_size=config.inference_batch_size))
+    # Spawned inference workers re-import the main module, they must not start a pool of their own
+    if config.model_warm_up and multiprocessing.current_process().name == 'MainProcess':
+        detector.warm_up()
+    return detector
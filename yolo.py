@@ -1,20 +1,148 @@
-from darkflow.net.build import TFNet
+import cv2
+import numpy as np
+from config import Config
+from detections import Detections
 
 
 class YOLO:
     """
     Python Wrapper for YOLO
+    The network itself runs on a pluggable backend (see BACKENDS), selected with the INFERENCE_BACKEND setting.
+    Every backend returns the boxes and the class probabilities of all the grid cells; the thresholding,
+    the NMS and the output format are shared.
     """
     displayImageWindow = False
     threshold = 0.12
+    nms_threshold = 0.4
+    max_batch_size = 8
     options = {
         'model': 'cfg/yolo.cfg',
         'load': 'weights/yolov2.weights',
+        'labels': 'cfg/coco.names',
         'threshold': threshold
     }
 
-    def __init__(self):
-        self.tfnet = TFNet(self.options)
+    def __init__(self, max_batch_size=None, backend=None, threshold=None):
+        config = Config()
+        backend = backend or config.inference_backend
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown inference backend: {backend}')
+        self.threshold = threshold or config.detection_threshold
+        self.backend = BACKENDS[backend](dict(self.options, threshold=self.threshold))
+        if max_batch_size:
+            self.max_batch_size = max_batch_size
 
     def detect(self, image):
-        return self.tfnet.return_predict(image)
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        """Detects the objects in a list of images.The images are resized and stacked into one tensor so
+           every `max_batch_size` frames share a single forward pass. Returns one Detections per image.
+        """
+        detections = []
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = images[start:start + self.max_batch_size]
+            boxes, class_probs = self.backend.forward(chunk)
+            detections.extend(self._decode(boxes, class_probs, [image.shape[:2] for image in chunk]))
+        return detections
+
+    def _decode(self, boxes, class_probs, shapes):
+        """Thresholds the boxes of the whole batch at once and applies the NMS per frame"""
+        label_ids = class_probs.argmax(axis=-1)
+        scores = class_probs.max(axis=-1)
+
+        detections = []
+        for index, (height, width) in enumerate(shapes):
+            keep = scores[index] > self.threshold
+            frame_boxes = boxes[index][keep] * [width, height, width, height]
+            frame_boxes = np.clip(frame_boxes, 0, [width - 1, height - 1, width - 1, height - 1])
+            frame = Detections(frame_boxes, scores[index][keep], label_ids[index][keep], self.backend.labels)
+            detections.append(frame.nms(self.nms_threshold))
+        return detections
+
+
+class DarkflowBackend:
+    """Runs the network with darkflow's TFNet on TensorFlow"""
+
+    def __init__(self, options):
+        # Importing darkflow pulls in TensorFlow, so it's only imported when this backend is selected
+        from darkflow.net.build import TFNet
+        self.tfnet = TFNet({'model': options['model'], 'load': options['load'], 'threshold': options['threshold']})
+        self.labels = self.tfnet.meta['labels']
+
+    def forward(self, images):
+        """Returns the corner boxes (normalized to 0-1) and the class probabilities of every anchor of every cell,
+           with the shapes (batch, cells * anchors, 4) and (batch, cells * anchors, classes)"""
+        batch = np.stack([self.tfnet.framework.resize_input(image) for image in images])
+        net_out = self.tfnet.sess.run(self.tfnet.out, {self.tfnet.inp: batch})
+        return self._decode_region(net_out)
+
+    def _decode_region(self, net_out):
+        """Decodes the YOLOv2 region output of the whole batch at once"""
+        meta = self.tfnet.meta
+        grid_h, grid_w = meta['out_size'][:2]
+        anchors = np.reshape(meta['anchors'], (-1, 2))
+        net_out = np.reshape(net_out, (len(net_out), grid_h, grid_w, len(anchors), 5 + meta['classes']))
+
+        cols = np.arange(grid_w).reshape(1, 1, grid_w, 1)
+        rows = np.arange(grid_h).reshape(1, grid_h, 1, 1)
+        x = (cols + _sigmoid(net_out[..., 0])) / grid_w
+        y = (rows + _sigmoid(net_out[..., 1])) / grid_h
+        w = np.exp(net_out[..., 2]) * anchors[:, 0] / grid_w
+        h = np.exp(net_out[..., 3]) * anchors[:, 1] / grid_h
+        class_probs = _softmax(net_out[..., 5:]) * _sigmoid(net_out[..., 4])[..., None]
+
+        boxes = np.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=-1).reshape(len(net_out), -1, 4)
+        return boxes, class_probs.reshape(len(net_out), -1, meta['classes'])
+
+
+class OpenCVBackend:
+    """Runs the darknet cfg and weights directly with OpenCV's DNN module, without TensorFlow"""
+
+    def __init__(self, options):
+        self.net = cv2.dnn.readNetFromDarknet(options['model'], options['load'])
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_size = _input_size(options['model'])
+        with open(options['labels']) as labels:
+            self.labels = [label.strip() for label in labels if label.strip()]
+
+    def forward(self, images):
+        """Same output as DarkflowBackend.forward. OpenCV's region layer already applies the sigmoids,
+           the anchors and the objectness, so only the box format is converted."""
+        # darkflow scales to 0-1 and flips the channels of the frame, swapRB does the same here
+        blob = cv2.dnn.blobFromImages(images, 1 / 255., self.input_size, swapRB=True, crop=False)
+        self.net.setInput(blob)
+        out = self.net.forward().reshape(len(images), -1, 5 + len(self.labels))
+        x, y, w, h = out[..., 0], out[..., 1], out[..., 2], out[..., 3]
+        boxes = np.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=-1)
+        return boxes, out[..., 5:]
+
+
+BACKENDS = {
+    'darkflow': DarkflowBackend,
+    'opencv': OpenCVBackend,
+}
+
+
+def _input_size(cfg_path):
+    """Reads the (width, height) of the network input from the [net] section of a darknet cfg"""
+    size = {}
+    with open(cfg_path) as cfg:
+        for line in cfg:
+            line = line.split('#')[0].strip()
+            if line.startswith('[') and line != '[net]':
+                break
+            key, _, value = line.partition('=')
+            if key.strip() in ('width', 'height'):
+                size[key.strip()] = int(value)
+    return size['width'], size['height']
+
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)